@@ -1,7 +1,12 @@
 import random
+import copy
 import pygame
 import time
-from Utilities import path_from_to, Direction
+import numpy as np
+from Utilities import Direction
+import pathfinding
+import mazes
+import rendering
 
 # Apologies, right now there are some magic numbers and some oddly written code
 # On the agenda are
@@ -13,14 +18,25 @@ class Gridworld:
 	Defines a generic gridworld. A gridworld environment is literally a grid
  	where an agent is allowed actions, with appropriate state-transitions
 	"""
-	def __init__(self, dimensions):
+	def __init__(self, dimensions, array_tiles = False):
 		self.dimensions = dimensions
-		self.tiles = [[0 for j in range(dimensions[1])] for i in range(dimensions[0])]
+		# With array_tiles the tiles are one contiguous int8 array instead of a list of lists.
+		# tiles[x][y] works the same either way, so code written for lists keeps working
+		self.array_tiles = array_tiles
+		if array_tiles:
+			self.tiles = np.zeros(dimensions, dtype=np.int8)
+		else:
+			self.tiles = [[0 for j in range(dimensions[1])] for i in range(dimensions[0])]
 		self.tilenames = ['floor']
 		
 	def peek(self):
 		""" Returns the current state of the environment, 
-		represented as a multidimensional numerical array """
+		represented as a multidimensional numerical array.
+		With array tiles this is a read-only view of the tiles, so nothing is copied """
+		if self.array_tiles:
+			view = self.tiles.view()
+			view.flags.writeable = False
+			return view
 		return self.tiles
 	
 	def tilename(self, num):
@@ -45,84 +61,192 @@ class ChestsAndKeys(Gridworld):
 	The only difference is that here is that I have taken the liberty of 
 	implementing some free parameters, such as how the maze is instantiated.
 	"""
-	def __init__(self, dimensions, num_chests, num_keys, drawing = False, resetting = True):
-		super().__init__(dimensions)
+	# A mazes.MazePool to sample mazes from instead of carving a new one for every environment
+	maze_pool = None
+	
+	def __init__(self, dimensions, num_chests, num_keys, drawing = False, resetting = True, array_tiles = False):
+		super().__init__(dimensions, array_tiles)
+		self.cached_maze_index = None
+		self.tilenames += ['wall', 'chest', 'key']
+		self.free_tiles = []
+		self.free_slots = {}
+		self.item_positions = {}
+		self.visited_tiles = []
+		self.renderer = None
+		self.game_display = None
+		self.new_level(num_chests, num_keys, resetting)
+		self.drawing = drawing
+		if drawing:
+			self.start_drawing()
+	
+	def new_level(self, num_chests, num_keys, resetting = True):
+		""" Starts a new level in place: carves a new maze into the existing tiles, refills the indexes
+		and places the agent and the items, drawing the same random numbers as creating a new environment does """
 		self.generate_maze()
 		self.resetting = resetting
-		self.tilenames += ['wall', 'chest', 'key']
 		self.agent_pos = (-1, -1)
 		self.agent_pos = self.free_position()
 		self.place_items(num_chests, 2)
 		self.place_items(num_keys, 3)
-		self.dimensions = dimensions
 		self.keys_in_inventory = 0
-		self.drawing = drawing
-		self.visited_tiles = []
-		if drawing:
-			SCREEN_DIMENSIONS = (800, 840)
-			self.game_display = pygame.display.set_mode(SCREEN_DIMENSIONS)
-			pygame.display.set_caption('Keys and Chests Gridworld')
-			self.sprite_size = int(SCREEN_DIMENSIONS[0] / max(dimensions))
-			def load(name):
-				return pygame.transform.scale(pygame.image.load('Resources/' + name), \
-								(self.sprite_size, self.sprite_size))
-			self.key_sprite = load('key.png')
-			self.chest_sprite = load('chest.png')
-			self.wall_sprite = load('wall.png')
-			self.floor_sprite = load('floor.png')
-			self.agent_sprite = load('agent.png')
-			self.tile_to_sprite = [self.floor_sprite, self.wall_sprite, self.chest_sprite, self.key_sprite]
-			pygame.font.init()
-			self.font = pygame.font.Font("Resources/FreeSans.ttf", 30)
+		self.visited_tiles.clear()
+	
+	def load_level(self, bank, index):
+		""" Replaces the level in place with level index of a levels.LevelBank holding levels of the same dimensions """
+		if bank.dimensions != tuple(self.dimensions):
+			raise ValueError("The level bank holds {} levels, not {}".format(bank.dimensions, self.dimensions))
+		level = bank.level(index)
+		tiles = level['tiles'].tolist()
+		for x in range(self.dimensions[0]):
+			self.tiles[x][:] = tiles[x]
+		self.tiles_replaced()
+		self.agent_pos = level['agent_pos']
+		self.keys_in_inventory = level['keys_in_inventory']
+		self.resetting = level['resetting']
+		self.visited_tiles.clear()
+	
+	def start_drawing(self):
+		""" Opens the window and fetches the sprites.
+		The window, sprites and font are shared by every environment in the process, so resets don't reload them """
+		SCREEN_DIMENSIONS = (800, 840)
+		self.game_display = rendering.display(SCREEN_DIMENSIONS, 'Keys and Chests Gridworld')
+		self.sprite_size = int(SCREEN_DIMENSIONS[0] / max(self.dimensions))
+		self.load_sprites()
+	
+	def load_sprites(self):
+		""" Fetches the sprites for the current sprite_size and the font from the process-wide asset cache """
+		sprites = rendering.sprites(self.sprite_size)
+		self.key_sprite = sprites['key.png']
+		self.chest_sprite = sprites['chest.png']
+		self.wall_sprite = sprites['wall.png']
+		self.floor_sprite = sprites['floor.png']
+		self.agent_sprite = sprites['agent.png']
+		self.tile_to_sprite = [self.floor_sprite, self.wall_sprite, self.chest_sprite, self.key_sprite]
+		self.font = rendering.font(30)
 	
 	def generate_maze(self):
-		""" Generates a maze by using the tree yielded by randomized depth-first search """		
+		""" Generates a maze by using the tree yielded by randomized depth-first search.
+		If maze_pool is set, a pre-generated maze is copied in from it instead """
+		if self.maze_pool is not None:
+			if self.maze_pool.dimensions != tuple(self.dimensions):
+				raise ValueError("The maze pool holds {} mazes, not {}".format(self.maze_pool.dimensions, self.dimensions))
+			maze = self.maze_pool.sample().tolist()
+			for x in range(self.dimensions[0]):
+				self.tiles[x][:] = maze[x]
+			self.tiles_replaced()
+			return
+		jumps = mazes.jump_table(self.dimensions)
+		height = self.dimensions[1]
+		explored = bytearray(self.dimensions[0] * height)
+		randrange = random.randrange # Draws the same numbers as random.randint(0, n - 1), with less call overhead
 		def dfs():
-			stack = [((0, 0), (0, 0))]
-			pos = (0, 0)
+			# Stack entries are (flat index of a node, flat index of the tile connecting it to the node that pushed it)
+			stack = [(0, 0)]
 			while len(stack) > 0:
-				old_pos = pos
-				pos, prev_dir = stack.pop()
-				if self.tiles[pos[0]][pos[1]] == self.tile_num("floor"):
-					self.tiles[pos[0]][pos[1]] = -1 # Mark node as explored
-					directions = Direction.legal_directions(pos, self.dimensions, jumpsize = 2)
+				node, edge = stack.pop()
+				if not explored[node]:
+					explored[node] = 1 # Mark node as explored
+					directions = list(jumps[node])
 					while len(directions) > 0:
-						index = random.randint(0, len(directions) - 1)
-						random_dir = directions[index] # Choose a random direction to explore
-						stack += [(Direction.add(pos, random_dir), Direction.multiply(random_dir, -0.5))]
-						directions.remove(random_dir)
-					mod = Direction.add(pos, prev_dir)
-					self.tiles[int(mod[0])][int(mod[1])] = -1 # Mark the connecting edge as explored too
+						index = randrange(len(directions))
+						stack.append(directions.pop(index)) # Choose a random direction to explore
+					explored[edge] = 1 # Mark the connecting edge as explored too
 						
 		dfs()
 		
-		# Go back and make everything that wasn't marked a -1 as a wall
+		# Go back and make everything that wasn't explored a wall
 		for x in range(self.dimensions[0]):
-			for y in range(self.dimensions[1]):
-				if self.tiles[x][y] != -1:
-					self.tiles[x][y] = 1
-				else:
-					self.tiles[x][y] = 0
+			self.tiles[x][:] = [1 - explored[i] for i in range(x * height, (x + 1) * height)]
+		self.tiles_replaced()
 				
+	def tiles_replaced(self):
+		""" Rebuilds everything derived from the tiles. Call this after the tiles were overwritten wholesale,
+		rather than changed through place_items and take_action """
+		self.neighbor_table = pathfinding.neighbor_table(self.tiles)
+		self.cached_maze_index = None
+		self.index_free_tiles()
+		self.index_items()
+	
+	def maze_index(self):
+		""" Returns the pathfinding.MazeIndex of the current walls, building it the first time it's needed.
+		Walls don't change during an episode, so it's only rebuilt after a new maze is generated or copied in """
+		if self.cached_maze_index is None:
+			self.cached_maze_index = pathfinding.MazeIndex(self.tiles, self.neighbor_table)
+		return self.cached_maze_index
+				
+	def index_free_tiles(self):
+		""" Rebuilds the index of free tiles (floor without an item on it) that free_position draws from.
+		The free tiles are kept in a list along with a map from position to slot in that list,
+		so a tile is added by appending it and removed by moving the last tile into its slot.
+		The list and map are refilled in place, and the positions are the neighbour table's own tuples """
+		tiles = self.tiles
+		self.free_tiles[:] = [pos for pos in self.neighbor_table.positions if tiles[pos[0]][pos[1]] == 0]
+		self.free_slots.clear()
+		self.free_slots.update(zip(self.free_tiles, range(len(self.free_tiles))))
+	
+	def index_items(self):
+		""" Rebuilds the sets of positions of every item type (every tile above a wall), emptying the existing sets first """
+		for positions in self.item_positions.values():
+			positions.clear()
+		tiles = self.tiles
+		for pos in self.neighbor_table.positions:
+			if tiles[pos[0]][pos[1]] > 1:
+				self.item_positions.setdefault(int(tiles[pos[0]][pos[1]]), set()).add(pos)
+	
+	def positions_of(self, tile):
+		""" Returns the positions of every item of a type, sorted the same way as a scan over x and then y """
+		return sorted(self.item_positions.get(tile, ()))
+	
+	def count_of(self, tile):
+		""" Returns the number of items of a type on the grid """
+		return len(self.item_positions.get(tile, ()))
+	
+	def owns(self, grid):
+		""" Returns whether a grid is this environment's own tiles (or a view of them), so its indexes describe it """
+		return grid is self.tiles or (isinstance(grid, np.ndarray) and grid.base is self.tiles)
+	
+	def mark_taken(self, pos):
+		""" Removes a position from the free tile index """
+		slot = self.free_slots.pop(pos)
+		last = self.free_tiles.pop()
+		if slot < len(self.free_tiles):
+			self.free_tiles[slot] = last
+			self.free_slots[last] = slot
+	
+	def mark_free(self, pos):
+		""" Adds a position to the free tile index """
+		if pos not in self.free_slots:
+			self.free_slots[pos] = len(self.free_tiles)
+			self.free_tiles.append(pos)
+	
 	def place_items(self, count, index):
 		""" Places a number of items indicated by index on random blank tiles """
 		for i in range(count):
 			free_pos = self.free_position()
 			self.tiles[free_pos[0]][free_pos[1]] = index
-			notFound = False
+			self.mark_taken(free_pos)
+			self.item_positions.setdefault(index, set()).add(free_pos)
 					
 	def free_position(self):
-		""" Returns a free position on the tiles """
-		not_found = True
-		while not_found:
-			rand_x = random.randint(0, self.dimensions[0] - 1)
-			rand_y = random.randint(0, self.dimensions[1] - 1)
-			if self.tiles[rand_x][rand_y] == 0:
-				if not (rand_x == self.agent_pos[0] and rand_y == self.agent_pos[1]):
-					return (rand_x, rand_y)
+		""" Returns a random free position on the tiles that the agent isn't standing on """
+		count = len(self.free_tiles)
+		agent_is_free = tuple(self.agent_pos) in self.free_slots
+		if agent_is_free:
+			count -= 1
+		if count <= 0:
+			raise ValueError("There are no free tiles left on the grid")
+		# When the agent's own tile is in the index, draw from one slot fewer and let the last slot stand in for the agent's
+		pos = self.free_tiles[random.randrange(count)]
+		if agent_is_free and pos == tuple(self.agent_pos):
+			pos = self.free_tiles[-1]
+		return pos
 	
 	def item_count(self, item_index):
 		""" Counts the number of items on the grid right now given the item index """
+		if item_index > 1:
+			return self.count_of(item_index)
+		if self.array_tiles:
+			return int(np.count_nonzero(self.tiles == item_index))
 		count = 0
 		for x in range(self.dimensions[0]):
 			for y in range(self.dimensions[1]):
@@ -136,12 +260,15 @@ class ChestsAndKeys(Gridworld):
 		
 	def take_action(self, action):
 		""" Takes an action, if possible, and returns a (state, reward) pair """
-		new_pos = Direction.add(self.agent_pos, action)
+		table = self.neighbor_table
+		move = Direction.DIRECTION_TO_INDEX.get(action, 4)
+		cell = self.agent_pos[0] * self.dimensions[1] + self.agent_pos[1]
 		
-		# If the agent takes an illegal action, stay in the current position
-		if action not in Direction.free_directions(self.agent_pos, self.tiles):
+		# If the agent takes an illegal action (staying put included), stay in the current position
+		if move == 4 or not (table.moves[cell] >> move) & 1:
 			return (self.state(), -0.30)
 		
+		new_pos = table.positions[table.steps[4 * cell + move]]
 		self.agent_pos = new_pos
 		total_reward = 0.0
 		
@@ -150,6 +277,8 @@ class ChestsAndKeys(Gridworld):
 		if stepped_on_tile == 2 and self.keys_in_inventory > 0:
 				self.keys_in_inventory -= 1
 				self.tiles[new_pos[0]][new_pos[1]] = 0
+				self.mark_free(new_pos)
+				self.item_positions[2].discard(new_pos)
 				if self.resetting:
 					self.place_items(1, 2)
 				total_reward += 1.0
@@ -159,6 +288,8 @@ class ChestsAndKeys(Gridworld):
 		elif stepped_on_tile == 3:
 			self.keys_in_inventory += 1
 			self.tiles[new_pos[0]][new_pos[1]] = 0
+			self.mark_free(new_pos)
+			self.item_positions[3].discard(new_pos)
 			if self.resetting:
 				self.place_items(1, 3)
 			
@@ -166,6 +297,9 @@ class ChestsAndKeys(Gridworld):
 						
 	def draw(self):
 		""" Draws the state of the grid """
+		if not rendering.is_current(self.game_display):
+			# The shared window was closed or replaced by another environment, so it and the font are fetched again
+			self.start_drawing()
 		self.game_display.fill((255, 255, 255))
 		for x in range(self.dimensions[0]):
 			for y in range(self.dimensions[1]):
@@ -177,29 +311,103 @@ class ChestsAndKeys(Gridworld):
 		self.game_display.blit(text, (0, 0))
 		pygame.display.flip()
 	
+	def rgb_array(self, sprite_size = 16):
+		""" Renders the state of the grid into an (H * sprite_size, W * sprite_size, 3) uint8 array, without needing a display.
+		Only the cells that changed since the last call are redrawn on the frame the renderer keeps, and a copy of it is returned """
+		if self.renderer is None or self.renderer.sprite_size != sprite_size:
+			self.renderer = rendering.Renderer(sprite_size)
+		state = self.state()
+		return self.renderer.render(state[0], state[1]).copy()
+	
+	@staticmethod
+	def rgb_arrays(states, sprite_size = 16, out = None):
+		""" Renders a list of states into a (len(states), H * sprite_size, W * sprite_size, 3) uint8 array, for exporting videos """
+		tiles = np.array([state[0] for state in states], dtype=np.int8)
+		return rendering.render_batch(tiles, [state[1] for state in states], sprite_size, out)
+	
+	def snapshot(self, include_rng = True):
+		""" Returns a snapshot of the environment that restore can bring it back to.
+		The tiles are packed into one byte per tile, and the state of the random module is included unless include_rng is False.
+		The order of the free tile index is kept too, since it decides where items respawn """
+		if self.array_tiles:
+			tiles = self.tiles.tobytes()
+		else:
+			tiles = b"".join(bytes(row) for row in self.tiles)
+		return {'tiles': tiles, 'free_tiles': tuple(self.free_tiles), 'agent_pos': tuple(self.agent_pos), \
+				'keys_in_inventory': self.keys_in_inventory, 'resetting': self.resetting, \
+				'rng': random.getstate() if include_rng else None}
+	
+	def restore(self, snapshot):
+		""" Brings the environment back to a snapshot taken by snapshot, on an environment of the same dimensions """
+		tiles = snapshot['tiles']
+		height = self.dimensions[1]
+		if self.array_tiles:
+			self.tiles[:] = np.frombuffer(tiles, dtype=np.int8).reshape(self.tiles.shape)
+		else:
+			for x in range(self.dimensions[0]):
+				self.tiles[x][:] = tiles[x * height:(x + 1) * height]
+		self.agent_pos = snapshot['agent_pos']
+		self.keys_in_inventory = snapshot['keys_in_inventory']
+		self.resetting = snapshot['resetting']
+		if snapshot['rng'] is not None:
+			random.setstate(snapshot['rng'])
+		# Snapshots are usually restored into the maze they came from, in which case the neighbour table and maze index stay valid
+		if self.neighbor_table.key != pathfinding.wall_key(self.tiles):
+			self.neighbor_table = pathfinding.neighbor_table(self.tiles)
+			self.cached_maze_index = None
+		self.free_tiles = list(snapshot['free_tiles'])
+		self.free_slots = {pos: slot for slot, pos in enumerate(self.free_tiles)}
+		self.index_items()
+	
+	def clone(self):
+		""" Returns an independent copy of the environment, without generating a maze or placing any items.
+		The neighbour table, the maze index and the sprites are shared with the copy, since none of them is ever modified """
+		other = copy.copy(self)
+		other.tiles = self.tiles.copy() if self.array_tiles else [row[:] for row in self.tiles]
+		other.free_tiles = self.free_tiles[:]
+		other.free_slots = dict(self.free_slots)
+		other.item_positions = {tile: set(positions) for tile, positions in self.item_positions.items()}
+		other.visited_tiles = self.visited_tiles[:]
+		other.renderer = None
+		return other
+	
 	def exit_drawing(self):
 		""" Exits pygame """
 		self.drawing = False
-		pygame.quit()
+		rendering.close_display()
 	
 	@staticmethod
-	def embed(state):
-		""" Returns an embedding of a chest and keys state that a neural network can read """
-		import numpy as np
-		def grid_with(grid, tile):
-			""" Returns the grid with everything except for 'tile' marked as 0 """
-			grid = [[0 if i != tile else tile for i in row] for row in grid]
-			return grid
-		wall_grid = np.array(grid_with(state[0], 1))
-		chest_grid = np.array(grid_with(state[0], 2))
-		key_grid = np.array(grid_with(state[0], 3)) 
-		
-		agent_grid = [[0 for i in row] for row in state[0]]
-		agent_grid[state[1][0]][state[1][1]] = 1
-		agent_grid = np.array(agent_grid)
-		image = np.concatenate((wall_grid, chest_grid, key_grid, agent_grid), axis=0)
-		image = image.reshape(image.shape[0], image.shape[1], 1)
-		return image
+	def embed(state, out = None):
+		""" Returns an embedding of a chest and keys state that a neural network can read.
+		If out is given, the (4W, H, 1) embedding is written into it instead of a new array """
+		grid = np.asarray(state[0])
+		if out is None:
+			out = np.empty((4 * grid.shape[0], grid.shape[1], 1), dtype=int)
+		ChestsAndKeys.embed_batch(grid[np.newaxis], [state[1]], out[np.newaxis])
+		return out
+	
+	@staticmethod
+	def embed_batch(tiles, agent_positions, out = None):
+		""" Writes the embeddings of a (B, W, H) batch of tiles and (B, 2) agent positions into out, a (B, 4W, H, 1) array.
+		The wall, chest, key and agent planes are stacked along x like in embed, and every tile is marked with its own value """
+		tiles = np.asarray(tiles)
+		agent_positions = np.asarray(agent_positions)
+		count, width = tiles.shape[0], tiles.shape[1]
+		if out is None:
+			out = np.empty((count, 4 * width, tiles.shape[2], 1), dtype=int)
+		planes = out[..., 0]
+		for plane, tile in enumerate((1, 2, 3)):
+			np.multiply(tiles == tile, tile, out=planes[:, plane * width:(plane + 1) * width], casting='unsafe')
+		agent_plane = planes[:, 3 * width:]
+		agent_plane[:] = 0
+		agent_plane[np.arange(count), agent_positions[:, 0], agent_positions[:, 1]] = 1
+		return out
+	
+	@staticmethod
+	def embed_states(states, out = None):
+		""" Writes the embeddings of a list of states into out, a (len(states), 4W, H, 1) array """
+		tiles = np.array([state[0] for state in states], dtype=np.int8)
+		return ChestsAndKeys.embed_batch(tiles, [state[1] for state in states], out)
 		
 	def print_out(self):
 		""" Prints the state of the grid and agent to console """
@@ -215,34 +423,42 @@ class ChestsAndKeys(Gridworld):
 		print("Number of keys: ", self.keys_in_inventory)
 
 class ChestsAndKeysSpecial(ChestsAndKeys):
-	def __init__(self, obs_window, state, drawing = False, resetting = False):
+	def __init__(self, obs_window, state, drawing = False, resetting = False, array_tiles = False):
 		self.grid = state[0]
 		self.obs_window = obs_window
-		super().__init__((len(self.grid), len(self.grid)), 0, 0, drawing, resetting)
+		self.cached_observation = None
+		super().__init__((len(self.grid), len(self.grid)), 0, 0, drawing, resetting, array_tiles)
 		for i in range(len(self.grid)):
 			for j in range(len(self.grid)):
 				self.tiles[i][j] = self.grid[i][j]
+		self.tiles_replaced()
 		self.agent_pos = state[1]
 		self.keys_in_inventory = state[2]
-		if drawing:
-			SCREEN_DIMENSIONS = (800, 840)
-			self.sprite_size = int(SCREEN_DIMENSIONS[0] / self.obs_window)
-			def load(name):
-				return pygame.transform.scale(pygame.image.load('Resources/' + name), \
-								(self.sprite_size, self.sprite_size))
-			self.key_sprite = load('key.png')
-			self.chest_sprite = load('chest.png')
-			self.wall_sprite = load('wall.png')
-			self.floor_sprite = load('floor.png')
-			self.agent_sprite = load('agent.png')
-			self.tile_to_sprite = [self.floor_sprite, self.wall_sprite, self.chest_sprite, self.key_sprite]
-			pygame.font.init()
-			self.font = pygame.font.Font("Resources/FreeSans.ttf", 30)
+	
+	def new_level(self, num_chests, num_keys, resetting = True):
+		""" Starts a new level in place, and drops the observation computed before it """
+		self.cached_observation = None
+		super().new_level(num_chests, num_keys, resetting)
+	
+	def load_level(self, bank, index):
+		""" Replaces the level in place with one from a level bank, and drops the observation computed before it """
+		self.cached_observation = None
+		super().load_level(bank, index)
+	
+	def start_drawing(self):
+		""" Opens the window and fetches the sprites, sized for the observation window rather than the whole grid """
+		super().start_drawing()
+		self.sprite_size = int(self.game_display.get_width() / self.obs_window)
+		self.load_sprites()
 				
 	def get_all_pos(self, state, tile_type):
 		""" Returns all the positions where there is a tile_type """
 		state_size = len(state[0])
 		grid = state[0]
+		if self.owns(grid):
+			return self.positions_of(tile_type)
+		if isinstance(grid, np.ndarray):
+			return [tuple(pos) for pos in np.argwhere(grid == tile_type).tolist()]
 		poses = []
 		for i in range(state_size):
 			for j in range(state_size):
@@ -259,7 +475,11 @@ class ChestsAndKeysSpecial(ChestsAndKeys):
 		represented as a multidimensional numerical array.
 		Since this is the special Chest and Keys environment, it actually shows a window of size self.obs_window
 		It projects non-visible objects onto its perhiphery on the last step of the shortest path to the object 
-		on the tile that leaves the current window."""
+		on the tile that leaves the current window.
+		The observation is computed once per step, from a single search rooted at the agent,
+		and the same one is returned until the next action is taken."""
+		if self.cached_observation is not None:
+			return self.cached_observation
 		upper_left = [self.agent_pos[0] - self.obs_window // 2, self.agent_pos[1] - self.obs_window // 2]
 		if self.agent_pos[0] < self.obs_window // 2:
 			upper_left[0] = 0
@@ -272,35 +492,33 @@ class ChestsAndKeysSpecial(ChestsAndKeys):
 			
 		window = [[self.tiles[y + upper_left[0]][x + upper_left[1]] for x in range(self.obs_window)] for y in range(self.obs_window)]
 		state = (self.tiles, self.agent_pos, self.keys_in_inventory)
-		key_poses = self.get_all_pos(state, 3)
-		chest_poses = self.get_all_pos(state, 2)
-		all_key_paths = [path_from_to(state, self.agent_pos, pos, self.grid) for pos in key_poses]
-		all_chest_paths = [path_from_to(state, self.agent_pos, pos, self.grid) for pos in chest_poses]
-		for path in all_key_paths:
-			key_pos = path[0][-1]
-			if self.lies_out_of_box(key_pos, upper_left, self.obs_window):
-				last_pos = path[0][0]
-				for pos in path[0]:
-					if self.lies_out_of_box(pos, upper_left, self.obs_window):
-						if random.randint(0, 1) == 0:
-							window[last_pos[0] - upper_left[0]][last_pos[1] - upper_left[1]] = 3
-						break
-					last_pos = pos
-		
-		for path in all_chest_paths:
-			chest_pos = path[0][-1]
-			if self.lies_out_of_box(chest_pos, upper_left, self.obs_window):
-				last_pos = path[0][0]
-				for pos in path[0]:
-					if self.lies_out_of_box(pos, upper_left, self.obs_window):
-						if random.randint(0, 1) == 0:
-							window[last_pos[0] - upper_left[0]][last_pos[1] - upper_left[1]] = 2
-						break
-					last_pos = pos
-		return (window, Direction.add(self.agent_pos, (-upper_left[0], -upper_left[1])), self.keys_in_inventory)
+		items = [(pos, 3) for pos in self.get_all_pos(state, 3)] + [(pos, 2) for pos in self.get_all_pos(state, 2)]
+		exits = pathfinding.window_exits(self.tiles, self.agent_pos, upper_left, self.obs_window, self.neighbor_table)
+		height = self.dimensions[1]
+		# A single draw of random bits decides which of the items outside the window get projected this step
+		projected = random.getrandbits(len(items)) if len(items) > 0 else 0
+		for i, (pos, tile) in enumerate(items):
+			exit = exits[pos[0] * height + pos[1]]
+			if self.lies_out_of_box(pos, upper_left, self.obs_window) and exit != -1 and (projected >> i) & 1 == 0:
+				exit_x, exit_y = divmod(exit, height)
+				window[exit_x - upper_left[0]][exit_y - upper_left[1]] = tile
+		self.cached_observation = (window, Direction.add(self.agent_pos, (-upper_left[0], -upper_left[1])), self.keys_in_inventory)
+		return self.cached_observation
+	
+	def take_action(self, action):
+		""" Takes an action, if possible, and returns a (state, reward) pair """
+		self.cached_observation = None
+		return super().take_action(action)
+	
+	def restore(self, snapshot):
+		""" Brings the environment back to a snapshot, and drops the observation computed before it """
+		super().restore(snapshot)
+		self.cached_observation = None
 	
 	def draw(self):
 		""" Draws the state of the grid """
+		if not rendering.is_current(self.game_display):
+			self.start_drawing()
 		self.game_display.fill((255, 255, 255))
 		for x in range(self.obs_window):
 			for y in range(self.obs_window):
@@ -321,12 +539,41 @@ size_of_map = 5
 num_chests = 8 # 9, 11
 num_keys = 1 # 1
 
+class ResetSpec:
+	"""
+	The distribution levels are drawn from when a CK-v0 environment resets.
+	Most levels have between range_chests[0] and range_chests[1] chests and num_keys keys,
+	but with probability switch_prob a level has no chests and between switch_keys[0] and switch_keys[1] keys instead
+	"""
+	def __init__(self, range_chests = (9, 11), num_keys = 1, switch_prob = 0.10, switch_keys = (1, 13)):
+		self.range_chests = range_chests
+		self.num_keys = num_keys
+		self.switch_prob = switch_prob
+		self.switch_keys = switch_keys
+	
+	def sample(self, switch = True):
+		""" Returns the (num_chests, num_keys) of a level, drawn with the random module.
+		Without switch the level always comes from the usual range, like the first level of an environment """
+		if switch and random.uniform(0, 1) <= self.switch_prob:
+			return 0, random.randint(self.switch_keys[0], self.switch_keys[1])
+		return random.randint(self.range_chests[0], self.range_chests[1]), self.num_keys
+	
+	def sample_batch(self, count, rng):
+		""" Returns (num_chests, num_keys) arrays for count levels, drawn with a NumPy generator """
+		switched = rng.random(count) <= self.switch_prob
+		num_chests = np.where(switched, 0, rng.integers(self.range_chests[0], self.range_chests[1] + 1, count))
+		num_keys = np.where(switched, rng.integers(self.switch_keys[0], self.switch_keys[1] + 1, count), self.num_keys)
+		return num_chests, num_keys
+
 class ChestAndKeysEnv(gym.Env, ChestsAndKeys):
-	metadata = {'render.modes': ['human']}
-	def __init__(self):
-		self.range_chests = (9, 11)
-		self.num_keys = 1
-		super().__init__((size_of_map, size_of_map), random.randint(self.range_chests[0], self.range_chests[1]), self.num_keys, False, resetting = True)
+	metadata = {'render.modes': ['human', 'rgb_array']}
+	def __init__(self, reset_spec = None, level_bank = None):
+		# With a levels.LevelBank, every reset loads the next level of the bank instead of generating one
+		self.level_bank = level_bank
+		self.next_level = 0
+		self.reset_spec = reset_spec if reset_spec is not None else ResetSpec()
+		num_chests, num_keys = self.reset_spec.sample(switch = False)
+		super().__init__((size_of_map, size_of_map), num_chests, num_keys, False, resetting = True)
 		self.num_steps = 0
 		self.total_reward = 0
 		size_of_obs = (size_of_map * 4, size_of_map, 1)
@@ -340,11 +587,16 @@ class ChestAndKeysEnv(gym.Env, ChestsAndKeys):
 		#self.draw()
 		return self._next_observation(), reward, self.num_steps > 17, {}
 	def _reset(self, draw = False):
-		switch_prob = 0.10
-		if random.uniform(0, 1) <= switch_prob:
-			super().__init__((size_of_map, size_of_map), 0, random.randint(1, 13), draw)
+		# The level is rebuilt in the existing tiles and indexes rather than by running __init__ again
+		if self.level_bank is not None:
+			self.load_level(self.level_bank, self.next_level % len(self.level_bank))
+			self.next_level += 1
 		else:
-			super().__init__((size_of_map, size_of_map), random.randint(self.range_chests[0], self.range_chests[1]), self.num_keys, draw, resetting = True)
+			num_chests, num_keys = self.reset_spec.sample()
+			self.new_level(num_chests, num_keys)
+		if draw:
+			self.start_drawing()
+		self.drawing = draw
 		self.num_steps = 0
 		#print(self.total_reward)
 		self.total_reward = 0
@@ -352,9 +604,206 @@ class ChestAndKeysEnv(gym.Env, ChestsAndKeys):
 	def _next_observation(self):
 		return self.embed(self.state())
 	def _render(self, mode='human'):
+		if mode == 'rgb_array':
+			return self.rgb_array()
 		super.draw()
 	def _close(self):
 		super.exit_drawing()
 	def _seed(self):
 		return 0
+	def snapshot(self, include_rng = True):
+		""" Returns a snapshot of the environment, including the episode's step count and reward so far """
+		snapshot = super().snapshot(include_rng)
+		snapshot['num_steps'], snapshot['total_reward'] = self.num_steps, self.total_reward
+		return snapshot
+	def restore(self, snapshot):
+		""" Brings the environment back to a snapshot, including the episode's step count and reward so far """
+		super().restore(snapshot)
+		self.num_steps, self.total_reward = snapshot['num_steps'], snapshot['total_reward']
 		
+
+class VecChestsAndKeys(VecEnv):
+	"""
+	Steps a batch of CK-v0 environments in lockstep with array operations instead of one ChestsAndKeys at a time.
+	The tiles of every environment live in one (B, W, H) int8 array, and the agent positions, key inventories,
+	step counters and resetting flags are arrays too. Legality, movement, key pickups, chest unlocking,
+	item respawning and the illegal move penalty are all computed for the whole batch at once.
+	Finished environments are reset automatically, and their last observation is kept in
+	infos[i]['terminal_observation'] the way stable_baselines' own vectorized environments do it.
+	"""
+	ACTION_VECTORS = np.array([Direction.get_direction_from_number(i) for i in range(5)])
+	ILLEGAL_MOVE_REWARD = -0.30
+	
+	def __init__(self, num_envs, dimensions = (size_of_map, size_of_map), max_steps = 18, maze_pool = None, reset_spec = None):
+		self.dimensions = dimensions
+		self.maze_pool = maze_pool
+		self.max_steps = max_steps
+		self.reset_spec = reset_spec if reset_spec is not None else ResetSpec()
+		self.tiles = np.zeros((num_envs,) + tuple(dimensions), dtype=np.int8)
+		self.agent_pos = np.zeros((num_envs, 2), dtype=np.int64)
+		self.keys_in_inventory = np.zeros(num_envs, dtype=np.int64)
+		self.resetting = np.ones(num_envs, dtype=bool)
+		self.num_steps = np.zeros(num_envs, dtype=np.int64)
+		self.total_reward = np.zeros(num_envs, dtype=np.float32)
+		self.observations = np.zeros((num_envs, dimensions[0] * 4, dimensions[1], 1), dtype=np.float32)
+		self.actions = np.zeros(num_envs, dtype=np.int64)
+		self.rng = np.random.default_rng()
+		self.scratch = None
+		observation_space = spaces.Box(low=0.0, high=3.0, shape=self.observations.shape[1:])
+		super().__init__(num_envs, observation_space, spaces.Discrete(4))
+	
+	def seed(self, seed = None):
+		""" Seeds the generator that every maze, item placement and respawn is drawn from """
+		self.rng = np.random.default_rng(seed)
+		return [seed] * self.num_envs
+	
+	def reset_envs(self, indices):
+		""" Generates a new level for each of the environments in indices, with the numbers of items drawn from the reset spec.
+		The mazes are carved together by mazes.generate_mazes, or sampled from the maze pool if there is one """
+		indices = np.asarray(indices)
+		count = len(indices)
+		if count == 0:
+			return
+		if self.maze_pool is not None:
+			tiles = self.maze_pool.sample(count, self.rng)
+		else:
+			tiles = mazes.generate_mazes(self.dimensions, count, self.rng)
+		num_chests, num_keys = self.reset_spec.sample_batch(count, self.rng)
+		agent_pos = mazes.place_items(tiles, num_chests, num_keys, self.rng)
+		self.tiles[indices] = tiles
+		self.agent_pos[indices] = agent_pos
+		self.resetting[indices] = True
+		self.keys_in_inventory[indices] = 0
+		self.num_steps[indices] = 0
+		self.total_reward[indices] = 0
+	
+	def reset(self):
+		""" Resets every environment and returns the batch of observations """
+		self.reset_envs(np.arange(self.num_envs))
+		return self.embed_all()
+	
+	def embed_all(self):
+		""" Writes the embedding of every environment into the observation buffer and returns a copy of it,
+		with the same layout as ChestsAndKeys.embed """
+		ChestsAndKeys.embed_batch(self.tiles, self.agent_pos, self.observations)
+		return self.observations.copy()
+	
+	def respawn(self, indices, tile):
+		""" Places one tile on a random free floor tile, away from the agent, in each of the environments in indices """
+		if len(indices) == 0:
+			return
+		free = self.tiles[indices] == 0
+		free[np.arange(len(indices)), self.agent_pos[indices, 0], self.agent_pos[indices, 1]] = False
+		# Taking the highest of some random scores over the free tiles picks one of them uniformly
+		scores = self.rng.random(free.shape)
+		scores[~free] = -1
+		flat = scores.reshape(len(indices), -1).argmax(axis=1)
+		placed = free.reshape(len(indices), -1).any(axis=1)
+		x, y = np.divmod(flat[placed], self.dimensions[1])
+		self.tiles[indices[placed], x, y] = tile
+	
+	def step_async(self, actions):
+		""" Stores the action numbers to take in every environment on the next step_wait """
+		self.actions[:] = actions
+	
+	def step_wait(self):
+		""" Takes the stored actions in every environment and returns (observations, rewards, dones, infos) """
+		batch = np.arange(self.num_envs)
+		vectors = self.ACTION_VECTORS[self.actions]
+		new_pos = self.agent_pos + vectors
+		inside = (new_pos[:, 0] >= 0) & (new_pos[:, 0] < self.dimensions[0]) & \
+				(new_pos[:, 1] >= 0) & (new_pos[:, 1] < self.dimensions[1])
+		clipped_x = np.clip(new_pos[:, 0], 0, self.dimensions[0] - 1)
+		clipped_y = np.clip(new_pos[:, 1], 0, self.dimensions[1] - 1)
+		legal = inside & (self.tiles[batch, clipped_x, clipped_y] != 1) & (self.actions != Direction.get_number_from_direction(Direction.STAY))
+		
+		rewards = np.where(legal, 0.0, self.ILLEGAL_MOVE_REWARD).astype(np.float32)
+		self.agent_pos[legal] = new_pos[legal]
+		stepped_on = self.tiles[batch, self.agent_pos[:, 0], self.agent_pos[:, 1]]
+		
+		# If the agent steps on a chest and has at least one key, reward the agent
+		unlocked = legal & (stepped_on == 2) & (self.keys_in_inventory > 0)
+		self.keys_in_inventory[unlocked] -= 1
+		rewards[unlocked] += 1.0
+		# If the agent steps on a key, add it to its inventory
+		picked_up = legal & (stepped_on == 3)
+		self.keys_in_inventory[picked_up] += 1
+		cleared = unlocked | picked_up
+		self.tiles[batch[cleared], self.agent_pos[cleared, 0], self.agent_pos[cleared, 1]] = 0
+		self.respawn(np.flatnonzero(unlocked & self.resetting), 2)
+		self.respawn(np.flatnonzero(picked_up & self.resetting), 3)
+		
+		self.num_steps += 1
+		self.total_reward += rewards
+		dones = self.num_steps >= self.max_steps
+		observations = self.embed_all()
+		infos = [{} for i in range(self.num_envs)]
+		finished = np.flatnonzero(dones)
+		if len(finished) > 0:
+			for i in finished:
+				infos[i]['terminal_observation'] = observations[i].copy()
+				infos[i]['episode'] = {'r': float(self.total_reward[i]), 'l': int(self.num_steps[i])}
+			self.reset_envs(finished)
+			observations = self.embed_all()
+		return observations, rewards, dones, infos
+	
+	def close(self):
+		""" There is nothing to release, since the environments are only arrays """
+		pass
+	
+	def get_images(self, sprite_size = 16):
+		""" Renders every environment into a (num_envs, H * sprite_size, W * sprite_size, 3) uint8 array, without needing a display """
+		return rendering.render_batch(self.tiles, self.agent_pos, sprite_size)
+	
+	def indices(self, indices):
+		""" Turns the indices argument of the VecEnv attribute methods into a list of environment indices """
+		if indices is None:
+			return range(self.num_envs)
+		if isinstance(indices, int):
+			return [indices]
+		return indices
+	
+	def get_attr(self, attr_name, indices = None):
+		""" Returns the value of an attribute for each environment, indexing into it if it is stored per environment """
+		value = getattr(self, attr_name)
+		if isinstance(value, np.ndarray) and len(value) == self.num_envs:
+			return [value[i] for i in self.indices(indices)]
+		return [value for i in self.indices(indices)]
+	
+	def set_attr(self, attr_name, value, indices = None):
+		""" Sets an attribute stored per environment for the given environments """
+		getattr(self, attr_name)[list(self.indices(indices))] = value
+	
+	def scratch_env(self):
+		""" Returns the ChestAndKeysEnv that env_method loads environments into, creating it the first time.
+		Creating it doesn't change the state of the random module """
+		if self.scratch is None:
+			state = random.getstate()
+			self.scratch = ChestAndKeysEnv(self.reset_spec)
+			if tuple(self.scratch.dimensions) != tuple(self.dimensions):
+				ChestsAndKeys.__init__(self.scratch, tuple(self.dimensions), 0, 0)
+			random.setstate(state)
+		return self.scratch
+	
+	def env_method(self, method_name, *method_args, indices = None, **method_kwargs):
+		""" Calls a method of each of the environments in indices and returns the results.
+		There are no per-environment objects, so each environment is restored into one ChestAndKeysEnv for the call,
+		and whatever the method changed (tiles, agent, inventory, step count and reward) is written back.
+		The results are copied, since the next environment is restored into the same object """
+		env = self.scratch_env()
+		results = []
+		for i in self.indices(indices):
+			free_tiles = tuple((int(x), int(y)) for x, y in np.argwhere(self.tiles[i] == 0))
+			env.restore({'tiles': self.tiles[i].tobytes(), 'free_tiles': free_tiles, \
+						'agent_pos': (int(self.agent_pos[i, 0]), int(self.agent_pos[i, 1])), \
+						'keys_in_inventory': int(self.keys_in_inventory[i]), 'resetting': bool(self.resetting[i]), 'rng': None, \
+						'num_steps': int(self.num_steps[i]), 'total_reward': float(self.total_reward[i])})
+			results.append(copy.deepcopy(getattr(env, method_name)(*method_args, **method_kwargs)))
+			self.tiles[i] = env.tiles
+			self.agent_pos[i] = env.agent_pos
+			self.keys_in_inventory[i] = env.keys_in_inventory
+			self.resetting[i] = env.resetting
+			self.num_steps[i] = env.num_steps
+			self.total_reward[i] = env.total_reward
+			ChestsAndKeys.embed_batch(self.tiles[i:i + 1], self.agent_pos[i:i + 1], self.observations[i:i + 1])
+		return results
@@ -0,0 +1,184 @@
+import multiprocessing
+import numpy as np
+from stable_baselines.common.vec_env import VecEnv
+from stable_baselines.common.vec_env.base_vec_env import CloudpickleWrapper
+
+# This file runs CK-v0 environments in worker processes that share their observation, reward and done buffers
+# with the parent, so only the commands and the (usually empty) info dicts go through the pipes
+
+def make_env():
+	""" Creates one CK-v0 environment, the default for every slot of a SharedMemoryVecEnv """
+	from Environment.envs.Gridworld import ChestAndKeysEnv
+	return ChestAndKeysEnv()
+
+def worker(remote, parent_remote, env_fns_wrapper, start, buffers, shapes):
+	""" Steps the environments numbered from start in a worker process, writing their results into the shared buffers """
+	parent_remote.close()
+	envs = [env_fn() for env_fn in env_fns_wrapper.var]
+	observations = np.frombuffer(buffers['observations'], dtype=np.float32).reshape(shapes['observations'])
+	rewards = np.frombuffer(buffers['rewards'], dtype=np.float32)
+	dones = np.frombuffer(buffers['dones'], dtype=np.bool_)
+	actions = np.frombuffer(buffers['actions'], dtype=np.int64)
+	try:
+		while True:
+			command, data = remote.recv()
+			if command == 'step':
+				infos = []
+				for i, env in enumerate(envs):
+					observation, reward, done, info = env.step(int(actions[start + i]))
+					if done:
+						info['terminal_observation'] = observation
+						observation = env.reset()
+					observations[start + i] = observation
+					rewards[start + i] = reward
+					dones[start + i] = done
+					infos.append(info)
+				remote.send(infos)
+			elif command == 'reset':
+				for i, env in enumerate(envs):
+					observations[start + i] = env.reset()
+				remote.send(None)
+			elif command == 'get_attr':
+				remote.send([getattr(envs[i], data) for i in range(len(envs))])
+			elif command == 'set_attr':
+				name, value, indices = data
+				for i in indices:
+					setattr(envs[i], name, value)
+				remote.send(None)
+			elif command == 'env_method':
+				name, args, kwargs, indices = data
+				remote.send([getattr(envs[i], name)(*args, **kwargs) for i in indices])
+			elif command == 'close':
+				for env in envs:
+					env.close()
+				remote.close()
+				break
+			else:
+				raise NotImplementedError("Unknown command {}".format(command))
+	except KeyboardInterrupt:
+		pass
+
+class SharedMemoryVecEnv(VecEnv):
+	"""
+	A vectorized environment that spreads environments over worker processes, several per worker.
+	Observations, rewards and dones are written by the workers straight into shared memory arrays,
+	so nothing but the commands and info dicts is pickled. The workers step all of their environments
+	in parallel on step_async, and step_wait waits for them and reads the shared arrays.
+	Finished environments are reset in the worker, with their last observation in infos[i]['terminal_observation'].
+	env_fns is a list of functions that create the environments, or a number of CK-v0 environments to create.
+	"""
+	def __init__(self, env_fns, num_workers = None, start_method = 'forkserver'):
+		self.waiting = False
+		self.closed = False
+		if isinstance(env_fns, int):
+			env_fns = [make_env] * env_fns
+		num_envs = len(env_fns)
+		if num_workers is None:
+			num_workers = multiprocessing.cpu_count()
+		num_workers = max(1, min(num_workers, num_envs))
+
+		# Ask one environment for the spaces, the same way stable_baselines' vectorized environments do
+		probe = env_fns[0]()
+		observation_space, action_space = probe.observation_space, probe.action_space
+		probe.close()
+
+		context = multiprocessing.get_context(start_method)
+		shapes = {'observations': (num_envs,) + observation_space.shape}
+		self.buffers = {
+			'observations': context.RawArray('f', int(np.prod(shapes['observations']))),
+			'rewards': context.RawArray('f', num_envs),
+			'dones': context.RawArray('b', num_envs),
+			'actions': context.RawArray('q', num_envs),
+		}
+		self.observations = np.frombuffer(self.buffers['observations'], dtype=np.float32).reshape(shapes['observations'])
+		self.rewards = np.frombuffer(self.buffers['rewards'], dtype=np.float32)
+		self.dones = np.frombuffer(self.buffers['dones'], dtype=np.bool_)
+		self.actions = np.frombuffer(self.buffers['actions'], dtype=np.int64)
+
+		# Worker w runs the environments from starts[w] up to starts[w + 1]
+		self.starts = [num_envs * w // num_workers for w in range(num_workers + 1)]
+		self.remotes, self.work_remotes = zip(*[context.Pipe() for w in range(num_workers)])
+		self.processes = []
+		for w in range(num_workers):
+			start, end = self.starts[w], self.starts[w + 1]
+			args = (self.work_remotes[w], self.remotes[w], CloudpickleWrapper(env_fns[start:end]), start, self.buffers, shapes)
+			process = context.Process(target=worker, args=args, daemon=True)
+			process.start()
+			self.processes.append(process)
+			self.work_remotes[w].close()
+		super().__init__(num_envs, observation_space, action_space)
+
+	def step_async(self, actions):
+		""" Writes the actions into shared memory and tells every worker to step its environments """
+		self.actions[:] = actions
+		for remote in self.remotes:
+			remote.send(('step', None))
+		self.waiting = True
+
+	def step_wait(self):
+		""" Waits for the workers and returns (observations, rewards, dones, infos) read from shared memory """
+		infos = []
+		for remote in self.remotes:
+			infos.extend(remote.recv())
+		self.waiting = False
+		return self.observations.copy(), self.rewards.copy(), self.dones.copy(), infos
+
+	def reset(self):
+		""" Resets every environment and returns the batch of observations """
+		for remote in self.remotes:
+			remote.send(('reset', None))
+		for remote in self.remotes:
+			remote.recv()
+		return self.observations.copy()
+
+	def close(self):
+		""" Stops the workers """
+		if self.closed:
+			return
+		if self.waiting:
+			for remote in self.remotes:
+				remote.recv()
+		for remote in self.remotes:
+			remote.send(('close', None))
+		for process in self.processes:
+			process.join()
+		self.closed = True
+
+	def worker_indices(self, indices):
+		""" Groups environment indices by the worker that runs them, as {worker: [local indices]} """
+		if indices is None:
+			indices = range(self.num_envs)
+		elif isinstance(indices, int):
+			indices = [indices]
+		grouped = {}
+		for i in indices:
+			w = np.searchsorted(self.starts, i, side='right') - 1
+			grouped.setdefault(w, []).append(i - self.starts[w])
+		return grouped
+
+	def get_attr(self, attr_name, indices = None):
+		""" Returns an attribute of each of the environments in indices """
+		values = []
+		for w, local in self.worker_indices(indices).items():
+			self.remotes[w].send(('get_attr', attr_name))
+			worker_values = self.remotes[w].recv()
+			values.extend(worker_values[i] for i in local)
+		return values
+
+	def set_attr(self, attr_name, value, indices = None):
+		""" Sets an attribute of each of the environments in indices """
+		grouped = self.worker_indices(indices)
+		for w, local in grouped.items():
+			self.remotes[w].send(('set_attr', (attr_name, value, local)))
+		for w in grouped:
+			self.remotes[w].recv()
+
+	def env_method(self, method_name, *method_args, indices = None, **method_kwargs):
+		""" Calls a method of each of the environments in indices and returns the results """
+		grouped = self.worker_indices(indices)
+		for w, local in grouped.items():
+			self.remotes[w].send(('env_method', (method_name, method_args, method_kwargs, local)))
+		results = []
+		for w in grouped:
+			results.extend(self.remotes[w].recv())
+		return results
@@ -1,5 +1,6 @@
 import random
 import math
+import numpy as np
 import matplotlib.pyplot as plt
 
 def distance(p1, p2):
@@ -37,6 +38,11 @@ def path_valid(path, v):
         if acc < 0: return False
     return True
 
+def path_distances(distance_matrix, paths):
+    """Calculates the lengths of a (K, L) array of routes at once."""
+    paths = np.asarray(paths)
+    return np.asarray(distance_matrix)[paths[:, :-1], paths[:, 1:]].sum(axis=1)
+
 def plot(points, v, path):
     plt.plot([points[i][0] for i in path], [points[i][1] for i in path], '-')
     plt.scatter([p[0] for p in points], [p[1] for p in points], c=[('blue' if i in v else 'red') for i in range(len(points))])
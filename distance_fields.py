@@ -0,0 +1,86 @@
+import numpy as np
+
+# This file computes breadth first distance fields for a whole batch of gridworlds at once
+# Grids are stacked into (B, W, H) arrays indexed as grids[b, x, y], matching the tiles[x][y] layout of ChestsAndKeys
+# Every expansion step grows the frontier of all grids together by shifting it one cell in each direction
+
+WALL = 1
+
+# The (dx, dy) of each action number, in the order of Direction.INDEX_TO_DIRECTION
+ACTION_VECTORS = np.array([(0, -1), (1, 0), (0, 1), (-1, 0), (0, 0)])
+STAY = 4
+
+def stack(grids):
+	""" Stacks a list of equally sized grids (lists of lists or arrays) into a (B, W, H) int8 array """
+	return np.array(grids, dtype=np.int8)
+
+def walls_of(tiles):
+	""" Returns the boolean wall mask of a (B, W, H) tile array """
+	return np.asarray(tiles) == WALL
+
+def source_mask(shape, positions):
+	""" Returns a (B, W, H) boolean mask with the single cell positions[b] set in every grid """
+	positions = np.asarray(positions)
+	mask = np.zeros(shape, dtype=bool)
+	mask[np.arange(shape[0]), positions[:, 0], positions[:, 1]] = True
+	return mask
+
+def grow(frontier, out):
+	""" Writes the cells one step away from the frontier (in any of the four directions) into out """
+	out[:] = False
+	out[:, 1:, :] |= frontier[:, :-1, :]
+	out[:, :-1, :] |= frontier[:, 1:, :]
+	out[:, :, 1:] |= frontier[:, :, :-1]
+	out[:, :, :-1] |= frontier[:, :, 1:]
+	return out
+
+def distance_fields(walls, sources, max_distance = None):
+	""" Returns (B, W, H) int32 maps of the walking distance from the sources of every grid, with -1 where unreachable.
+	walls is a (B, W, H) boolean mask, and sources is either a (B, 2) array with one position per grid
+	or a (B, W, H) boolean mask, in which case the distance is to the closest source """
+	walls = np.asarray(walls, dtype=bool)
+	sources = np.asarray(sources)
+	if sources.ndim == 2:
+		sources = source_mask(walls.shape, sources)
+	free = ~walls
+	frontier = sources & free
+	reached = frontier.copy()
+	grown = np.empty_like(frontier)
+	distances = np.full(walls.shape, -1, dtype=np.int32)
+	distances[frontier] = 0
+	distance = 0
+	while frontier.any() and (max_distance is None or distance < max_distance):
+		distance += 1
+		grow(frontier, grown)
+		np.logical_and(grown, free, out=frontier)
+		frontier &= ~reached
+		reached |= frontier
+		distances[frontier] = distance
+	return distances
+
+def first_steps(tiles, positions, tile_type):
+	""" Returns (actions, distances) for the first step of a shortest path from positions[b] to the nearest tile_type in every grid.
+	actions are action numbers as used by Direction, with STAY (and a distance of -1) where no such tile can be reached.
+	The cell the agent stands on never counts as a target, and ties between steps go to the lowest action number """
+	tiles = np.asarray(tiles)
+	positions = np.asarray(positions)
+	batch = np.arange(tiles.shape[0])
+	targets = tiles == tile_type
+	targets[batch, positions[:, 0], positions[:, 1]] = False
+	to_target = distance_fields(walls_of(tiles), targets)
+
+	# Pad with unreachable cells so the neighbours of border cells can be read without bounds checks
+	padded = np.full((tiles.shape[0], tiles.shape[1] + 2, tiles.shape[2] + 2), -1, dtype=np.int32)
+	padded[:, 1:-1, 1:-1] = to_target
+	neighbor_distances = np.empty((tiles.shape[0], STAY), dtype=np.int64)
+	for action in range(STAY):
+		dx, dy = ACTION_VECTORS[action]
+		neighbor_distances[:, action] = padded[batch, positions[:, 0] + 1 + dx, positions[:, 1] + 1 + dy]
+	unreachable = neighbor_distances < 0
+	neighbor_distances[unreachable] = np.iinfo(np.int64).max
+	actions = np.argmin(neighbor_distances, axis=1)
+	distances = neighbor_distances[batch, actions] + 1
+	stuck = unreachable.all(axis=1)
+	actions[stuck] = STAY
+	distances[stuck] = -1
+	return actions, distances
@@ -0,0 +1,87 @@
+import numpy as np
+import common
+
+# Nodes are renumbered so the keys come first, which makes the key balance of a visited set depend only on its bits.
+# Every layer of the dynamic program holds the visited sets of one size, and a whole layer is extended at once.
+
+_layers = {}
+_solutions = {}
+MAX_SOLUTIONS = 4096
+
+def popcounts(size):
+    """Returns the number of set bits of every mask below 2 ** size"""
+    counts = np.zeros(1 << size, dtype=np.int64)
+    for bit in range(size):
+        counts[1 << bit:1 << (bit + 1)] = counts[:1 << bit] + 1
+    return counts
+
+def layers(n_keys, n_chests):
+    """Returns (valid, layers): whether every visited set can be visited by a valid route,
+    and for every route length up to 2 * n_keys the array of valid sets of that size.
+    A set is valid when it holds at least as many keys as chests, since its keys can always be visited first.
+    Built once per instance size"""
+    key = (n_keys, n_chests)
+    found = _layers.get(key)
+    if found is None:
+        size = n_keys + n_chests
+        counts = popcounts(size)
+        masks = np.arange(1 << size)
+        keys = counts[masks & ((1 << n_keys) - 1)]
+        chests = counts - keys
+        valid = keys >= chests
+        found = _layers[key] = (valid, [masks[valid & (counts == c)] for c in range(2 * n_keys + 1)])
+    return found
+
+def solve_dp(distance_matrix, v, s):
+    """Returns an optimal (route, length) visiting every key in v and as many chests from s,
+    with at least as many keys as chests visited at every point of the route.
+    dp[mask, last] is the length of the shortest valid route through the nodes in mask ending at last.
+    Results are remembered, since agents ask about the same instance until an item gets picked up"""
+    keys, chests = sorted(v), sorted(s)
+    nodes = keys + chests
+    size = len(nodes)
+    length = 2 * len(keys)
+    matrix = np.asarray(distance_matrix, dtype=float)[np.ix_(nodes, nodes)]
+    memo_key = (len(keys), matrix.tobytes())
+    if memo_key in _solutions:
+        route, distance = _solutions[memo_key]
+        return [nodes[i] for i in route], distance
+    if length == 0:
+        return [], 0.0
+
+    # Unreachable pairs get a huge finite length, so every reachable state still knows which state it came from
+    finite = np.isfinite(matrix)
+    big = (matrix[finite].max() + 1) * size if finite.any() else 1.0
+    matrix = np.where(finite, matrix, big)
+
+    dp = np.full((1 << size, size), np.inf)
+    parent = np.full((1 << size, size), -1, dtype=np.int64)
+    for key in range(len(keys)):
+        dp[1 << key, key] = 0
+    bits = 1 << np.arange(size)
+    valid, by_size = layers(len(keys), len(chests))
+    for masks in by_size[1:length]:
+        # best[m, j] is the shortest way to extend a route through masks[m] to node j, and via[m, j] the node before j
+        extended = dp[masks][:, :, None] + matrix[None, :, :]
+        via = extended.argmin(axis=1)
+        best = np.take_along_axis(extended, via[:, None, :], axis=1)[:, 0, :]
+        for j in range(size):
+            # Every set of the layer that doesn't hold j yet, and stays valid with it, leads to a different new set
+            fresh = ((masks & bits[j]) == 0) & valid[masks | bits[j]]
+            targets = masks[fresh] | bits[j]
+            dp[targets, j] = best[fresh, j]
+            parent[targets, j] = via[fresh, j]
+
+    finals = by_size[length]
+    end = np.unravel_index(np.argmin(dp[finals]), (len(finals), size))
+    mask, last = int(finals[end[0]]), int(end[1])
+    route = []
+    while last != -1:
+        route.append(last)
+        mask, last = mask & ~(1 << last), int(parent[mask, last])
+    route.reverse()
+    distance = common.path_distance(distance_matrix, [nodes[i] for i in route])
+    if len(_solutions) >= MAX_SOLUTIONS:
+        _solutions.clear()
+    _solutions[memo_key] = (route, distance)
+    return [nodes[i] for i in route], distance
@@ -1,7 +1,10 @@
 import random
+import numpy as np
 import common
+import multistart
 
-def solve_greedy(distance_matrix, v, s):
+def greedy_path(distance_matrix, v, s):
+    """Returns a route that starts at a random key and always goes to the nearest node it may visit next"""
     current = random.choice(tuple(v))
     path = [current]
 
@@ -23,13 +26,26 @@ def solve_greedy(distance_matrix, v, s):
         path.append(next_node)
         current = next_node
 
+    return path
+
+def solve_greedy(distance_matrix, v, s):
+    path = greedy_path(distance_matrix, v, s)
     return path, common.path_distance(distance_matrix, path)
 
-def best_of_greedy(distance_matrix, v, s, n):
-    best_path, best_distance = solve_greedy(distance_matrix, v, s)
-    for i in range(n-1):
-        path, distance = solve_greedy(distance_matrix, v, s)
-        if distance < best_distance:
-            best_path, best_distance = path, distance
-    return best_path, best_distance
+# Restarts are sent to other processes in tasks of this many, so a seed gives the same route for any number of workers
+RESTARTS_PER_TASK = 10
+
+def best_of_greedy(distance_matrix, v, s, n, workers=1, seed=None):
+    """Returns the shortest of n greedy routes, from random first keys.
+    With workers other than 1 the restarts are spread over a process pool (every core for None),
+    and with a seed the result is the same every time"""
+    if workers != 1 or seed is not None:
+        sizes = [min(RESTARTS_PER_TASK, n - start) for start in range(0, n, RESTARTS_PER_TASK)]
+        results = multistart.run(best_of_greedy, [(distance_matrix, v, s, size) for size in sizes], \
+                                 multistart.task_seeds(len(sizes), seed, workers), workers)
+        return multistart.best(results)
+    # Every greedy route has 2 * len(v) nodes, so all the restarts are scored together
+    paths = [greedy_path(distance_matrix, v, s) for i in range(n)]
+    best_path = paths[int(np.argmin(common.path_distances(distance_matrix, paths)))]
+    return best_path, common.path_distance(distance_matrix, best_path)
     
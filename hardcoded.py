@@ -3,10 +3,20 @@ from Agent import GreedyAgent
 import time
 import Utilities
 import random
+import sys
+import levels
+
+# Pass the file name of a levels.LevelBank of 10x10 levels to evaluate on the same levels every run
+level_bank = levels.LevelBank(sys.argv[1]) if len(sys.argv) > 1 else None
 
 total_reward = 0
-for j in range(10000):
+if level_bank is not None:
 	global_env = ChestsAndKeys((10, 10), 2, 9, drawing = False)
+for j in range(10000):
+	if level_bank is not None:
+		global_env.load_level(level_bank, j % len(level_bank))
+	else:
+		global_env = ChestsAndKeys((10, 10), 2, 9, drawing = False)
 	env = ChestsAndKeysSpecial(5, global_env.state(), drawing = False)
 	model = GreedyAgent(env.state())
 	for i in range(10):
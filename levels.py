@@ -0,0 +1,108 @@
+import multiprocessing
+import numpy as np
+import mazes
+
+# This file stores whole ChestsAndKeys levels (maze, items, agent start and inventory) in a bank file,
+# so evaluations can run over the same levels every time without generating them again
+# Bank files are a 16 byte header followed by one fixed-size record per level, with every tile packed into 2 bits
+
+BANK_HEADER = np.dtype([('magic', 'S4'), ('width', '<u4'), ('height', '<u4'), ('count', '<u4')])
+BANK_MAGIC = b'CKLV'
+TILES_PER_BYTE = 4
+
+def record_dtype(dimensions):
+	""" Returns the record layout of a level of the given dimensions """
+	packed = (dimensions[0] * dimensions[1] + TILES_PER_BYTE - 1) // TILES_PER_BYTE
+	return np.dtype([('tiles', 'u1', (packed,)), ('agent_pos', '<u2', (2,)), ('keys_in_inventory', 'u1'), \
+					('resetting', 'u1'), ('num_chests', 'u1'), ('num_keys', 'u1')])
+
+def pack_tiles(tiles):
+	""" Packs a (B, W, H) batch of tiles into (B, ceil(W * H / 4)) bytes of 2 bit tiles """
+	flat = tiles.reshape(len(tiles), -1).astype(np.uint8)
+	padded = np.zeros((len(flat), -(-flat.shape[1] // TILES_PER_BYTE) * TILES_PER_BYTE), dtype=np.uint8)
+	padded[:, :flat.shape[1]] = flat
+	quarters = padded.reshape(len(flat), -1, TILES_PER_BYTE)
+	return quarters[:, :, 0] | quarters[:, :, 1] << 2 | quarters[:, :, 2] << 4 | quarters[:, :, 3] << 6
+
+def unpack_tiles(packed, dimensions):
+	""" Unpacks (B, ceil(W * H / 4)) bytes of 2 bit tiles into a (B, W, H) int8 array """
+	packed = np.asarray(packed)
+	shifts = np.array([0, 2, 4, 6], dtype=np.uint8)
+	flat = ((packed[:, :, None] >> shifts) & 3).reshape(len(packed), -1)
+	return flat[:, :dimensions[0] * dimensions[1]].astype(np.int8).reshape((-1,) + tuple(dimensions))
+
+def generate_records(dimensions, count, spec, seed):
+	""" Generates count levels with a generator seeded by seed (a np.random.SeedSequence) and returns them as records.
+	spec is a (num_chests, num_keys) pair, or an object with a sample_batch(count, rng) method like Gridworld.ResetSpec """
+	rng = np.random.default_rng(seed)
+	tiles = mazes.generate_mazes(dimensions, count, rng)
+	if isinstance(spec, tuple):
+		num_chests, num_keys = np.full(count, spec[0]), np.full(count, spec[1])
+	else:
+		num_chests, num_keys = spec.sample_batch(count, rng)
+	agent_pos = mazes.place_items(tiles, num_chests, num_keys, rng)
+	records = np.zeros(count, dtype=record_dtype(dimensions))
+	records['tiles'] = pack_tiles(tiles)
+	records['agent_pos'] = agent_pos
+	records['resetting'] = 1
+	records['num_chests'] = num_chests
+	records['num_keys'] = num_keys
+	return records
+
+def _generate_batch(arguments):
+	""" Unpacks the arguments of generate_records for a worker process """
+	return generate_records(*arguments)
+
+class LevelBank:
+	"""
+	A read-only bank of levels, memory-mapped from a file written by LevelBank.write.
+	Every level is a fixed-size record, so level n is read straight from its offset,
+	and only the pages of the levels that are used are ever read from disk.
+	"""
+	def __init__(self, filename):
+		header = np.fromfile(filename, dtype=BANK_HEADER, count=1)
+		if len(header) == 0 or header['magic'][0] != BANK_MAGIC:
+			raise ValueError("{} is not a level bank file".format(filename))
+		self.dimensions = (int(header['width'][0]), int(header['height'][0]))
+		self.records = np.memmap(filename, dtype=record_dtype(self.dimensions), mode='r', \
+								offset=BANK_HEADER.itemsize, shape=(int(header['count'][0]),))
+
+	def __len__(self):
+		return len(self.records)
+
+	def levels(self, indices):
+		""" Returns the (tiles, agent_pos, keys_in_inventory) of the levels at the given indices,
+		as (B, W, H), (B, 2) and (B,) arrays """
+		records = self.records[np.asarray(indices)]
+		return unpack_tiles(records['tiles'], self.dimensions), records['agent_pos'].astype(np.int64), \
+				records['keys_in_inventory'].astype(np.int64)
+
+	def level(self, index):
+		""" Returns level index as a dictionary with its tiles as a (W, H) int8 array, the agent's start, its inventory,
+		whether items respawn, and the number of chests and keys it was generated with """
+		record = self.records[index]
+		return {'tiles': unpack_tiles(record['tiles'][np.newaxis], self.dimensions)[0], \
+				'agent_pos': (int(record['agent_pos'][0]), int(record['agent_pos'][1])), \
+				'keys_in_inventory': int(record['keys_in_inventory']), 'resetting': bool(record['resetting']), \
+				'num_chests': int(record['num_chests']), 'num_keys': int(record['num_keys'])}
+
+	@staticmethod
+	def write(filename, dimensions, count, spec, seed = None, workers = None, batch_size = 4096):
+		""" Generates count levels in batches spread over worker processes and writes them to a new bank file.
+		Every batch has its own seed spawned from seed, so a seed gives the same bank whatever the number of workers """
+		dimensions = tuple(dimensions)
+		seeds = np.random.SeedSequence(seed).spawn(-(-count // batch_size))
+		batches = [(dimensions, min(batch_size, count - start), spec, seeds[i]) \
+					for i, start in enumerate(range(0, count, batch_size))]
+		header = np.zeros(1, dtype=BANK_HEADER)
+		header['magic'], header['width'], header['height'], header['count'] = BANK_MAGIC, dimensions[0], dimensions[1], count
+		with open(filename, 'wb') as f:
+			header.tofile(f)
+			if workers == 1:
+				for batch in batches:
+					_generate_batch(batch).tofile(f)
+			else:
+				with multiprocessing.Pool(workers) as pool:
+					for records in pool.imap(_generate_batch, batches):
+						records.tofile(f)
+		return LevelBank(filename)
@@ -54,7 +54,7 @@ print(total_reward / 100.0)
 for i in range(12000):
 	print(i)
 	world = Gridworld.ChestsAndKeys((5, 5), 4, 2, drawing = False)
-	agent = Agent.HeuristicAgent(world.state())
+	agent = Agent.HeuristicAgent(world.state(), world)
 	trajectory = agent.trajectory(world.state())
 	state = world.state()
 	for action in trajectory:
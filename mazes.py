@@ -0,0 +1,181 @@
+import random
+import numpy as np
+
+# This file generates ChestsAndKeys mazes in bulk, and stores pre-generated mazes on disk so resets can sample them
+# Mazes are (W, H) int8 arrays indexed as maze[x, y], with 1 for walls and 0 for floor, like ChestsAndKeys.tiles
+
+WALL = 1
+FLOOR = 0
+
+# Directions between maze nodes, in the order Direction.legal_directions lists them (west, east, north, south)
+NODE_STEPS = np.array([(-1, 0), (1, 0), (0, -1), (0, 1)])
+
+def node_graph(dimensions):
+	""" Returns (positions, neighbors) for the nodes of a maze, which sit on the tiles with two even coordinates.
+	neighbors[n, d] is the node reached by jumping two tiles from node n in direction d, or -1 if that leaves the grid """
+	columns, rows = (dimensions[0] + 1) // 2, (dimensions[1] + 1) // 2
+	i, j = np.divmod(np.arange(columns * rows), rows)
+	positions = np.stack((2 * i, 2 * j), axis=1)
+	neighbors = np.full((columns * rows, 4), -1, dtype=np.int64)
+	for d, (di, dj) in enumerate(NODE_STEPS):
+		inside = (i + di >= 0) & (i + di < columns) & (j + dj >= 0) & (j + dj < rows)
+		neighbors[inside, d] = (i + di)[inside] * rows + (j + dj)[inside]
+	return positions, neighbors
+
+_jump_tables = {}
+
+def jump_table(dimensions):
+	""" Returns, for every flat cell index x * height + y, a tuple of the (cell, tile in between) flat index pairs
+	two tiles away in the order Direction.legal_directions lists them (west, east, north, south).
+	This is what the depth-first search in ChestsAndKeys.generate_maze steps along, and it's built once per grid size """
+	dimensions = tuple(dimensions)
+	table = _jump_tables.get(dimensions)
+	if table is None:
+		width, height = dimensions
+		table = []
+		for x in range(width):
+			for y in range(height):
+				jumps = []
+				for dx, dy in NODE_STEPS.tolist():
+					if 0 <= x + 2 * dx < width and 0 <= y + 2 * dy < height:
+						jumps.append(((x + 2 * dx) * height + y + 2 * dy, (x + dx) * height + y + dy))
+				table.append(tuple(jumps))
+		table = _jump_tables[dimensions] = tuple(table)
+	return table
+
+def generate_mazes(dimensions, count, rng = None, out = None):
+	""" Generates count mazes with the same randomized depth-first search as ChestsAndKeys.generate_maze,
+	running the searches of all of them in lockstep with array operations.
+	Returns a (count, W, H) int8 array, written into out if it is given """
+	if rng is None:
+		rng = np.random.default_rng()
+	if out is None:
+		out = np.empty((count,) + tuple(dimensions), dtype=np.int8)
+	out[:] = WALL
+	positions, neighbors = node_graph(dimensions)
+	nodes = len(positions)
+	batch = np.arange(count)
+
+	# Every node is pushed at most once per neighbour, plus the root
+	capacity = 4 * nodes + 1
+	stack_nodes = np.zeros((count, capacity), dtype=np.int64)
+	stack_dirs = np.full((count, capacity), -1, dtype=np.int64)
+	top = np.ones(count, dtype=np.int64)
+	visited = np.zeros((count, nodes), dtype=bool)
+
+	while True:
+		active = top > 0
+		if not active.any():
+			break
+		top[active] -= 1
+		popped = np.where(active, top, 0)
+		node = stack_nodes[batch, popped]
+		came_by = stack_dirs[batch, popped]
+		new = active & ~visited[batch, node]
+		if not new.any():
+			continue
+		fresh = batch[new]
+		node, came_by = node[new], came_by[new]
+		visited[fresh, node] = True
+		x, y = positions[node, 0], positions[node, 1]
+		out[fresh, x, y] = FLOOR
+		# Carve the tile between this node and the node that pushed it (the root has no such tile)
+		from_parent = came_by >= 0
+		step = NODE_STEPS[came_by[from_parent]]
+		out[fresh[from_parent], x[from_parent] - step[:, 0], y[from_parent] - step[:, 1]] = FLOOR
+
+		# Push the neighbours in a uniformly random order, which is what repeatedly picking a random remaining direction does
+		candidates = neighbors[node]
+		order = np.argsort(np.where(candidates >= 0, rng.random(candidates.shape), 2.0), axis=1)
+		for k in range(4):
+			direction = order[:, k]
+			target = candidates[np.arange(len(fresh)), direction]
+			pushing = target >= 0
+			slots = top[fresh[pushing]]
+			stack_nodes[fresh[pushing], slots] = target[pushing]
+			stack_dirs[fresh[pushing], slots] = direction[pushing]
+			top[fresh[pushing]] += 1
+	return out
+
+def place_items(tiles, num_chests, num_keys, rng):
+	""" Places an agent and num_chests[b] chests and num_keys[b] keys on random floor tiles of every maze in a (B, W, H) batch,
+	writing the items into tiles. Returns the (B, 2) agent positions """
+	count, width, height = tiles.shape
+	num_chests, num_keys = np.broadcast_to(num_chests, count), np.broadcast_to(num_keys, count)
+	# Sorting the free tiles by random scores gives a random order to place the agent, then the chests, then the keys in
+	flat = tiles.reshape(count, -1)
+	free = flat == FLOOR
+	if (free.sum(axis=1) < 1 + num_chests + num_keys).any():
+		raise ValueError("There aren't enough free tiles to place the agent and all of the items")
+	scores = rng.random(flat.shape)
+	scores[~free] = 2.0
+	order = np.argsort(scores, axis=1)
+	rank = np.arange(flat.shape[1])
+	items = np.where(rank < 1 + num_chests[:, None], 2, 3)
+	items[(rank == 0) | (rank >= 1 + (num_chests + num_keys)[:, None])] = 0
+	np.put_along_axis(flat, order, np.where(items > 0, items, np.take_along_axis(flat, order, axis=1)), axis=1)
+	return np.stack(np.divmod(order[:, 0], height), axis=1)
+
+# Pool files are a 16 byte header followed by one record of bit-packed wall flags per maze
+POOL_HEADER = np.dtype([('magic', 'S4'), ('width', '<u4'), ('height', '<u4'), ('count', '<u4')])
+POOL_MAGIC = b'CKMZ'
+
+class MazePool:
+	"""
+	A read-only pool of pre-generated mazes, memory-mapped from a file written by MazePool.write.
+	Every maze is stored as W * H bits, so a million 10x10 mazes take about 13MB,
+	and only the pages that get sampled are ever read from disk.
+	"""
+	def __init__(self, filename):
+		header = np.fromfile(filename, dtype=POOL_HEADER, count=1)
+		if len(header) == 0 or header['magic'][0] != POOL_MAGIC:
+			raise ValueError("{} is not a maze pool file".format(filename))
+		self.dimensions = (int(header['width'][0]), int(header['height'][0]))
+		self.record_size = (self.dimensions[0] * self.dimensions[1] + 7) // 8
+		self.records = np.memmap(filename, dtype=np.uint8, mode='r', offset=POOL_HEADER.itemsize, \
+								shape=(int(header['count'][0]), self.record_size))
+
+	def __len__(self):
+		return len(self.records)
+
+	def mazes(self, indices, out = None):
+		""" Returns the mazes at the given indices as a (len(indices), W, H) int8 array, written into out if it is given """
+		cells = self.dimensions[0] * self.dimensions[1]
+		walls = np.unpackbits(self.records[np.asarray(indices)], axis=1, count=cells)
+		walls = walls.reshape((-1,) + self.dimensions)
+		if out is None:
+			return walls.astype(np.int8)
+		out[:] = walls
+		return out
+
+	def maze(self, index):
+		""" Returns the maze at index as a (W, H) int8 array """
+		return self.mazes([index])[0]
+
+	def sample(self, count = None, rng = None):
+		""" Returns one random maze, or a (count, W, H) array of them.
+		Without a NumPy generator the random module is used, so random.seed makes the draws reproducible """
+		if count is None:
+			index = random.randrange(len(self)) if rng is None else int(rng.integers(len(self)))
+			return self.maze(index)
+		if rng is None:
+			indices = [random.randrange(len(self)) for i in range(count)]
+		else:
+			indices = rng.integers(len(self), size=count)
+		return self.mazes(indices)
+
+	@staticmethod
+	def write(filename, dimensions, count, rng = None, batch_size = 4096):
+		""" Generates count mazes in batches and writes them to a new pool file """
+		if rng is None:
+			rng = np.random.default_rng()
+		header = np.zeros(1, dtype=POOL_HEADER)
+		header['magic'], header['width'], header['height'], header['count'] = POOL_MAGIC, dimensions[0], dimensions[1], count
+		buffer = np.empty((batch_size,) + tuple(dimensions), dtype=np.int8)
+		with open(filename, 'wb') as f:
+			header.tofile(f)
+			for start in range(0, count, batch_size):
+				size = min(batch_size, count - start)
+				mazes = generate_mazes(dimensions, size, rng, buffer[:size])
+				np.packbits(mazes.reshape(size, -1).astype(bool), axis=1).tofile(f)
+		return MazePool(filename)
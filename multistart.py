@@ -0,0 +1,66 @@
+import atexit
+import multiprocessing
+import random
+import numpy as np
+
+# This file runs independent restarts of the route solvers (greedy, 2-opt, annealing chains) in a process pool
+# that is created the first time it's needed and kept for the whole process.
+# Every restart is a task with its own seed, and the best result is picked in task order, so a fixed seed
+# gives the same route whatever the number of workers, including running every task in this process
+
+_pool = None
+_pool_workers = None
+
+def pool(workers=None):
+    """Returns the process pool with the given number of workers (every core for None), creating it if needed"""
+    global _pool, _pool_workers
+    if _pool is None or _pool_workers != workers:
+        close_pool()
+        _pool = multiprocessing.Pool(workers)
+        _pool_workers = workers
+    return _pool
+
+def close_pool():
+    """Stops the workers of the pool, if there is one"""
+    global _pool, _pool_workers
+    if _pool is not None:
+        _pool.terminate()
+        _pool.join()
+    _pool = None
+    _pool_workers = None
+
+atexit.register(close_pool)
+
+def task_seeds(count, seed=None, workers=1):
+    """Returns a seed for each of count tasks, spawned from seed.
+    Without a seed, tasks that run in this process just use the random module as it is,
+    while tasks sent to the pool get fresh seeds, since forked workers start with the same random state"""
+    if seed is None and workers == 1:
+        return [None] * count
+    return [int(child.generate_state(1)[0]) for child in np.random.SeedSequence(seed).spawn(count)]
+
+def run_seeded(task):
+    """Calls function(*arguments) for a (function, arguments, seed) task with the random module seeded by seed.
+    The random state from before is put back afterwards, so tasks run in this process don't change it"""
+    function, arguments, seed = task
+    if seed is None:
+        return function(*arguments)
+    state = random.getstate()
+    random.seed(seed)
+    try:
+        return function(*arguments)
+    finally:
+        random.setstate(state)
+
+def run(function, arguments, seeds, workers=1):
+    """Calls function on each of the argument tuples, seeded by the matching seed, and returns the results in order.
+    The calls are spread over the pool unless workers is 1, or this is a daemonic process (like the workers
+    of a vectorized environment), which can't have children"""
+    tasks = [(function, args, seed) for args, seed in zip(arguments, seeds)]
+    if workers == 1 or len(tasks) < 2 or multiprocessing.current_process().daemon:
+        return [run_seeded(task) for task in tasks]
+    return pool(workers).map(run_seeded, tasks, chunksize=1)
+
+def best(results):
+    """Returns the (route, length) with the shortest length, the first one on ties"""
+    return min(results, key=lambda result: result[1])
@@ -1,3 +1,4 @@
+import numpy as np
 import common
 import greedy
 
@@ -8,22 +9,49 @@ def swap_2opt(route, i, k):
 	return new_route
 
 def solve_2opt(matrix, v, s, n=100):
-	improvement = True
+	"""Improves the best of n greedy routes with 2-opt moves until none of them helps.
+	Every move reverses route[i:k + 1] in place. Its change in length only depends on the two edges
+	at the ends of the segment (the distances are symmetric, so the reversed edges inside keep their lengths),
+	and its feasibility on the running balance of keys over chests before and inside the segment.
+	After a move the scan carries on from the next k instead of starting over"""
 	best_route, best_distance = greedy.best_of_greedy(matrix, v, s, n)
 	best_route += list(s - set(best_route))
-	while improvement: 
+	length = len(v)*2
+	route = best_route[:length]
+	if isinstance(matrix, np.ndarray):
+		matrix = matrix.tolist()
+	sign = [1 if node in v else -1 for node in route]
+	# balance[j + 1] is the number of keys minus chests in route[:j + 1], so balance[i] is the balance before position i
+	balance = [0] * (length + 1)
+	for j in range(length):
+		balance[j + 1] = balance[j] + sign[j]
+	improvement = True
+	while improvement:
 		improvement = False
-		for i in range(len(v)*2 - 1):
-			for k in range(i+1, len(v)*2):
-				new_route = swap_2opt(best_route, i, k)
-				if common.path_valid(new_route[:len(v)*2], v):
-					new_distance = common.path_distance(matrix, new_route[:len(v)*2])
-					if new_distance < best_distance:
-						# print(best_distance, new_distance)
-						best_distance = new_distance
-						best_route = new_route
-						improvement = True
-						break #improvement found, return to the top of the while loop
-			if improvement:
-				break
-	return best_route[:len(v)*2], best_distance
+		for i in range(length - 1):
+			before = route[i - 1] if i > 0 else -1
+			highest = balance[i]
+			for k in range(i + 1, length):
+				# Reversed, the segment's balances become balance[i] + balance[k + 1] - balance[j] for i <= j <= k,
+				# which stay non-negative as long as the highest balance[j] in that range isn't above balance[i] + balance[k + 1]
+				if balance[k] > highest:
+					highest = balance[k]
+				if balance[i] + balance[k + 1] < highest:
+					continue
+				first, last = route[i], route[k]
+				delta = 0.0
+				if before != -1:
+					delta += matrix[before][last] - matrix[before][first]
+				if k + 1 < length:
+					after = route[k + 1]
+					delta += matrix[first][after] - matrix[last][after]
+				if delta < -1e-12:
+					route[i:k + 1] = route[k:i - 1 if i > 0 else None:-1]
+					sign[i:k + 1] = sign[k:i - 1 if i > 0 else None:-1]
+					for j in range(i, k + 1):
+						balance[j + 1] = balance[j] + sign[j]
+					highest = max(balance[i:k + 1])
+					improvement = True
+	best_route = route + best_route[length:]
+	best_distance = common.path_distance(matrix, route)
+	return best_route[:length], best_distance
@@ -0,0 +1,537 @@
+import heapq
+import numpy as np
+from collections import OrderedDict
+
+# This file holds the pathfinding engine shared by the agents, the utilities and the environments
+# Grids are indexed as grid[x][y], and only walls block movement (items can be walked over)
+
+WALL = 1
+
+# The (dx, dy) of the four moves, numbered like Direction.INDEX_TO_DIRECTION (north, east, south, west)
+MOVE_STEPS = ((0, -1), (1, 0), (0, 1), (-1, 0))
+# The order the searches expand neighbours in (west, east, north, south), as move numbers
+EXPANSION_ORDER = (3, 1, 0, 2)
+
+class SearchStats:
+	"""
+	Counters for measuring how much work the searches are doing.
+	Call reset() before a run and read the counters afterwards
+	"""
+	def __init__(self):
+		self.reset()
+
+	def reset(self):
+		""" Zeroes all the counters """
+		self.calls = 0
+		self.expanded = 0
+		self.last_expanded = 0
+
+	def mean_expanded(self):
+		""" Returns the average number of nodes expanded per search """
+		return self.expanded / self.calls if self.calls > 0 else 0.0
+
+stats = SearchStats()
+
+class AStar:
+	"""
+	A* search on a gridworld using a binary heap for the frontier and a Manhattan distance heuristic.
+	The score, parent and closed buffers are flat lists indexed by x * height + y. They are allocated once
+	for a grid shape and reused between searches: every search stamps its own id into them,
+	so nothing has to be cleared when the next search starts.
+	"""
+	def __init__(self, dimensions):
+		self.dimensions = dimensions
+		size = dimensions[0] * dimensions[1]
+		self.g = [0] * size
+		self.came_from = [0] * size
+		self.seen = [0] * size
+		self.closed = [0] * size
+		self.search_id = 0
+
+	def reconstruct_path(self, current):
+		""" Walks the parent buffer back from current and returns the (path, length) pair """
+		height = self.dimensions[1]
+		path = []
+		while current != -1:
+			path.append(divmod(current, height))
+			current = self.came_from[current]
+		path.reverse()
+		return path, len(path) - 1
+
+	def search(self, table, start, end):
+		""" Returns the (path, total_length) of the shortest path from start to end on the grid described by a NeighborTable,
+		or None if there isn't one """
+		height = self.dimensions[1]
+		self.search_id += 1
+		search_id = self.search_id
+		g, came_from, seen, closed = self.g, self.came_from, self.seen, self.closed
+		neighbors, xs, ys = table.neighbors, table.xs, table.ys
+		end_x, end_y = end
+
+		source = start[0] * height + start[1]
+		target = end_x * height + end_y
+		g[source] = 0
+		came_from[source] = -1
+		seen[source] = search_id
+		h = abs(start[0] - end_x) + abs(start[1] - end_y)
+		frontier = [(h, h, source)]
+		expanded = 0
+		result = None
+
+		while frontier:
+			_, _, current = heapq.heappop(frontier)
+			if closed[current] == search_id:
+				continue # A stale entry for a node that was already expanded with a better score
+			if current == target:
+				result = self.reconstruct_path(current)
+				break
+			closed[current] = search_id
+			expanded += 1
+			tentative_g = g[current] + 1
+			for neighbor in neighbors[current]:
+				if closed[neighbor] == search_id:
+					continue
+				if seen[neighbor] != search_id or tentative_g < g[neighbor]:
+					seen[neighbor] = search_id
+					g[neighbor] = tentative_g
+					came_from[neighbor] = current
+					h = abs(xs[neighbor] - end_x) + abs(ys[neighbor] - end_y)
+					heapq.heappush(frontier, (tentative_g + h, h, neighbor))
+
+		stats.calls += 1
+		stats.expanded += expanded
+		stats.last_expanded = expanded
+		return result
+
+def as_lists(grid):
+	""" Returns the grid as a list of lists. Indexing an array one cell at a time is much slower than indexing lists,
+	so grids stored as arrays are converted once before a search """
+	if isinstance(grid, np.ndarray):
+		return grid.tolist()
+	return grid
+
+_searchers = {}
+
+def searcher_for(dimensions):
+	""" Returns the A* searcher owning the buffers for grids of the given dimensions """
+	searcher = _searchers.get(dimensions)
+	if searcher is None:
+		searcher = _searchers[dimensions] = AStar(dimensions)
+	return searcher
+
+def path_from_to(grid, start, end, walls = None):
+	""" Returns the (path, total_length) of the optimal path from start to end on the grid,
+	or None if there is no such path. The wall_key of the grid can be passed in if it is already known """
+	return searcher_for((len(grid), len(grid[0]))).search(neighbor_table(grid, walls), start, end)
+
+# Maps every tile value to 1 if it blocks movement and 0 otherwise, for building wall keys at C speed
+_WALL_TABLE = bytes(1 if tile == WALL else 0 for tile in range(256))
+
+def wall_key(grid):
+	""" Returns a hashable key describing only the walls of a grid, so items moving around don't change it """
+	if isinstance(grid, np.ndarray):
+		return (grid.shape[1], (grid == WALL).astype(np.uint8).tobytes())
+	return (len(grid[0]), b"".join(bytes(row) for row in grid).translate(_WALL_TABLE))
+
+class NeighborTable:
+	"""
+	The moves available from every cell of a grid, indexed by flat index x * height + y.
+	neighbors[i] is a tuple of the walkable cells next to i, in the order the searches expand them (west, east, north, south).
+	steps[4 * i + d] is the cell reached by move d from i (numbered like Direction.INDEX_TO_DIRECTION), or -1 if a wall
+	or the border is in the way, and bit d of moves[i] is set when that move is allowed.
+	positions[i], xs[i] and ys[i] give the coordinates of i, so stepping around never builds a new tuple.
+	Only the walls go into the table, so it stays valid while items come and go
+	"""
+	def __init__(self, grid, walls = None):
+		self.key = walls if walls is not None else wall_key(grid)
+		height, blocked = self.key
+		self.dimensions = (len(blocked) // height, height)
+		self.positions, self.xs, self.ys, candidates, choices = grid_geometry(self.dimensions)
+		# Candidates that leave the grid point one past the last cell, which counts as blocked
+		blocked = np.append(np.frombuffer(blocked, dtype=np.uint8), 1)
+		open_moves = blocked[candidates] == 0
+		self.steps = np.where(open_moves, candidates, -1).ravel().tolist()
+		moves = open_moves @ MOVE_BITS
+		self.moves = moves.tolist()
+		self.neighbors = list(map(choices.__getitem__, (16 * np.arange(len(moves)) + moves).tolist()))
+
+	def can_move(self, pos, move):
+		""" Returns whether move number move is allowed from the position pos """
+		return (self.moves[pos[0] * self.dimensions[1] + pos[1]] >> move) & 1 == 1
+
+_geometries = {}
+
+MOVE_BITS = 1 << np.arange(4)
+
+def grid_geometry(dimensions):
+	""" Returns (positions, xs, ys, candidates, choices) for grids of the given dimensions, built once per size.
+	candidates is a (cells, 4) array of the cell reached by every move from every cell ignoring walls,
+	with the number of cells standing in for moves that leave the grid.
+	choices[16 * i + m] is the tuple of neighbours of cell i, in expansion order, when the moves in bitmask m are open """
+	geometry = _geometries.get(dimensions)
+	if geometry is None:
+		width, height = dimensions
+		x, y = np.divmod(np.arange(width * height), height)
+		candidates = np.empty((width * height, 4), dtype=np.int64)
+		for d, (dx, dy) in enumerate(MOVE_STEPS):
+			inside = (x + dx >= 0) & (x + dx < width) & (y + dy >= 0) & (y + dy < height)
+			candidates[:, d] = np.where(inside, (x + dx) * height + y + dy, width * height)
+		positions = [divmod(i, height) for i in range(width * height)]
+		choices = [tuple(int(candidates[i, d]) for d in EXPANSION_ORDER if (m >> d) & 1) \
+					for i in range(width * height) for m in range(16)]
+		geometry = _geometries[dimensions] = (positions, x.tolist(), y.tolist(), candidates, choices)
+	return geometry
+
+_neighbor_tables = OrderedDict()
+NEIGHBOR_TABLE_CAPACITY = 1024
+
+def neighbor_table(grid, walls = None):
+	""" Returns the NeighborTable of a grid's walls, reusing the last few tables that were built.
+	The wall_key of the grid can be passed in if it is already known """
+	key = walls if walls is not None else wall_key(grid)
+	table = _neighbor_tables.get(key)
+	if table is None:
+		table = _neighbor_tables[key] = NeighborTable(grid, key)
+		if len(_neighbor_tables) > NEIGHBOR_TABLE_CAPACITY:
+			_neighbor_tables.popitem(last = False)
+	else:
+		_neighbor_tables.move_to_end(key)
+	return table
+
+class PathCache:
+	"""
+	A bounded least-recently-used cache of shortest paths keyed on (wall layout, start, end).
+	Walls don't change during an episode and items don't block movement,
+	so an entry stays correct when keys are picked up or chests are opened.
+	Cached paths are stored as tuples so callers can't modify them by accident.
+	"""
+	def __init__(self, capacity = 65536):
+		self.capacity = capacity
+		self.entries = OrderedDict()
+		self.hits = 0
+		self.misses = 0
+
+	def path(self, grid, start, end, walls = None):
+		""" Returns the (path, total_length) of the shortest path from start to end, or None if there isn't one.
+		The wall_key of the grid can be passed in when making many queries on the same grid """
+		key = (walls if walls is not None else wall_key(grid), tuple(start), tuple(end))
+		entries = self.entries
+		if key in entries:
+			self.hits += 1
+			entries.move_to_end(key)
+			return entries[key]
+		self.misses += 1
+		result = path_from_to(grid, start, end, key[0])
+		if result is not None:
+			result = (tuple(result[0]), result[1])
+		entries[key] = result
+		if len(entries) > self.capacity:
+			entries.popitem(last = False)
+		return result
+
+	def distance(self, grid, start, end, walls = None):
+		""" Returns the length of the shortest path from start to end, or None if there isn't one """
+		result = self.path(grid, start, end, walls)
+		return result[1] if result is not None else None
+
+	def hit_rate(self):
+		""" Returns the fraction of lookups that were answered from the cache """
+		lookups = self.hits + self.misses
+		return self.hits / lookups if lookups > 0 else 0.0
+
+	def clear(self):
+		""" Drops every entry and zeroes the hit and miss counters """
+		self.entries.clear()
+		self.hits = 0
+		self.misses = 0
+
+path_cache = PathCache()
+
+def breadth_first_tree(grid, source, targets = None, table = None):
+	""" Runs a breadth first search from source and returns flat (distances, parents) lists indexed by x * height + y.
+	Unreached cells have a distance of -1. If a set of flat target indices is given,
+	the search stops as soon as all of them have been reached. The grid's NeighborTable can be passed in if it is already known """
+	if table is None:
+		table = neighbor_table(grid)
+	width, height = table.dimensions
+	neighbors = table.neighbors
+	distances = [-1] * (width * height)
+	parents = [-1] * (width * height)
+	start = source[0] * height + source[1]
+	distances[start] = 0
+	remaining = set(targets) - {start} if targets is not None else None
+	queue = [start]
+	head = 0
+	while head < len(queue):
+		if remaining is not None and not remaining:
+			break
+		current = queue[head]
+		head += 1
+		next_distance = distances[current] + 1
+		for neighbor in neighbors[current]:
+			if distances[neighbor] == -1:
+				distances[neighbor] = next_distance
+				parents[neighbor] = current
+				queue.append(neighbor)
+				if remaining is not None:
+					remaining.discard(neighbor)
+	stats.calls += 1
+	stats.expanded += head
+	stats.last_expanded = head
+	return distances, parents
+
+def nearest(grid, start, tile_type, table = None):
+	""" Runs one breadth first search from start that stops at the closest tile of tile_type.
+	Returns (target, first_step, distance), or None if no such tile can be reached.
+	Ties between equally close targets go to the smallest (x, y), and the start itself never counts as a target.
+	The grid's NeighborTable can be passed in if it is already known """
+	if table is None:
+		table = neighbor_table(grid)
+	grid = as_lists(grid)
+	width, height = table.dimensions
+	neighbors, xs, ys = table.neighbors, table.xs, table.ys
+	source = start[0] * height + start[1]
+	# The first cell on the way to every discovered cell, so the step can be read off without rebuilding a path
+	first_step = [-1] * (width * height)
+	first_step[source] = source
+	layer = [source]
+	distance = 0
+	expanded = 0
+	result = None
+	while layer and result is None:
+		distance += 1
+		next_layer = []
+		found = []
+		for current in layer:
+			expanded += 1
+			step = first_step[current]
+			for neighbor in neighbors[current]:
+				if first_step[neighbor] != -1:
+					continue
+				first_step[neighbor] = neighbor if current == source else step
+				next_layer.append(neighbor)
+				if grid[xs[neighbor]][ys[neighbor]] == tile_type:
+					found.append(neighbor)
+		if found:
+			target = min(found)
+			result = (table.positions[target], table.positions[first_step[target]], distance)
+		layer = next_layer
+	stats.calls += 1
+	stats.expanded += expanded
+	stats.last_expanded = expanded
+	return result
+
+def window_exits(grid, start, upper_left, size, table = None):
+	""" Runs one breadth first search from start, which has to lie in the size x size window whose corner is upper_left.
+	Returns a flat list giving, for every reached cell, the flat index of the last cell inside the window
+	on the shortest path from start to it. Cells whose path never leaves the window, and unreached cells, get -1.
+	The grid's NeighborTable can be passed in if it is already known """
+	if table is None:
+		table = neighbor_table(grid)
+	width, height = table.dimensions
+	neighbors, xs, ys = table.neighbors, table.xs, table.ys
+	left, top = upper_left
+	right, bottom = left + size, top + size
+	exits = [-1] * (width * height)
+	seen = [False] * (width * height)
+	source = start[0] * height + start[1]
+	seen[source] = True
+	queue = [source]
+	head = 0
+	while head < len(queue):
+		current = queue[head]
+		head += 1
+		exit = exits[current]
+		for neighbor in neighbors[current]:
+			if seen[neighbor]:
+				continue
+			seen[neighbor] = True
+			queue.append(neighbor)
+			# Once a path has left the window it keeps its first exit, otherwise it leaves here if the neighbour is outside
+			if exit != -1:
+				exits[neighbor] = exit
+			elif not (left <= xs[neighbor] < right and top <= ys[neighbor] < bottom):
+				exits[neighbor] = current
+	stats.calls += 1
+	stats.expanded += head
+	stats.last_expanded = head
+	return exits
+
+class DistanceOracle:
+	"""
+	Answers distance and path queries between a fixed list of nodes on a grid.
+	One breadth first search is run per node, only until it has reached the nodes after it in the list.
+	That fills a symmetric distance matrix (inf where there is no path),
+	and the parent tree of every search is kept so paths can be rebuilt on demand.
+	"""
+	def __init__(self, grid, nodes, table = None):
+		if table is None:
+			table = neighbor_table(grid)
+		self.nodes = [tuple(node) for node in nodes]
+		self.height = table.dimensions[1]
+		flat = [x * self.height + y for x, y in self.nodes]
+		self.flat = flat
+		self.matrix = np.full((len(flat), len(flat)), np.inf)
+		self.parents = []
+		for i in range(len(flat)):
+			distances, parents = breadth_first_tree(grid, self.nodes[i], flat[i + 1:], table)
+			self.parents.append(parents)
+			self.matrix[i, i] = 0
+			for j in range(i + 1, len(flat)):
+				if distances[flat[j]] != -1:
+					self.matrix[i, j] = self.matrix[j, i] = distances[flat[j]]
+
+	def distance(self, i, j):
+		""" Returns the length of the shortest path between nodes i and j """
+		return self.matrix[i, j]
+
+	def path(self, i, j):
+		""" Returns the (path, total_length) of the shortest path from node i to node j, or None if there isn't one """
+		if self.matrix[i, j] == np.inf:
+			return None
+		# Only the search from the earlier node of the pair is guaranteed to have reached the other one
+		source, target = (i, j) if i < j else (j, i)
+		parents = self.parents[source]
+		current = self.flat[target]
+		path = []
+		while current != -1:
+			path.append(divmod(current, self.height))
+			current = parents[current]
+		if i < j:
+			path.reverse()
+		return path, len(path) - 1
+
+class MazeIndex:
+	"""
+	Answers distance and path queries without searching on mazes whose walkable cells form a tree,
+	which is what the randomized depth-first search in ChestsAndKeys.generate_maze carves.
+	The tree is rooted at the first walkable cell and the lowest common ancestor of two cells
+	is found with a sparse table over the Euler tour, so a distance costs O(1) and a path O(path length).
+	If the walls don't form a single tree (say a grid was copied in by hand), every query falls back to the path cache.
+	"""
+	def __init__(self, grid, table = None):
+		self.grid = as_lists(grid)
+		self.dimensions = (len(grid), len(grid[0]))
+		self.neighbor_table = table if table is not None else neighbor_table(grid)
+		self.key = self.neighbor_table.key
+		self.walls = self.key[1]
+		self.is_tree = False
+		cells = [i for i, wall in enumerate(self.walls) if not wall]
+		edges = sum(len(self.neighbor_table.neighbors[i]) for i in cells) // 2
+		# A connected graph is a tree exactly when it has one edge fewer than it has nodes.
+		# With that many edges a graph can still have a cycle in one part and be disconnected from the rest,
+		# which the search in build notices by not reaching every cell
+		if len(cells) > 0 and edges == len(cells) - 1:
+			self.build(cells[0])
+			self.is_tree = len(self.first) == len(cells)
+
+	def neighbors(self, current):
+		""" Returns the flat indices of the walkable cells next to a flat index """
+		return self.neighbor_table.neighbors[current]
+
+	def build(self, root):
+		""" Roots the tree at root and fills the parent, depth, Euler tour and sparse table arrays """
+		size = len(self.walls)
+		self.parent = [-1] * size
+		self.depth = [0] * size
+		self.first = {}
+		euler = []
+		stack = [(root, iter(self.neighbors(root)))]
+		self.first[root] = 0
+		euler.append(root)
+		while stack:
+			current, children = stack[-1]
+			child = next(children, None)
+			if child is None:
+				stack.pop()
+				if stack:
+					euler.append(stack[-1][0])
+				continue
+			if child in self.first:
+				continue
+			self.parent[child] = current
+			self.depth[child] = self.depth[current] + 1
+			self.first[child] = len(euler)
+			euler.append(child)
+			stack.append((child, iter(self.neighbors(child))))
+
+		depth = self.depth
+		self.table = [euler]
+		span = 1
+		while 2 * span <= len(euler):
+			previous = self.table[-1]
+			self.table.append([previous[i] if depth[previous[i]] <= depth[previous[i + span]] else previous[i + span] \
+								for i in range(len(euler) - 2 * span + 1)])
+			span *= 2
+
+	def lowest_common_ancestor(self, a, b):
+		""" Returns the flat index of the lowest common ancestor of two flat indices """
+		left, right = self.first[a], self.first[b]
+		if left > right:
+			left, right = right, left
+		level = (right - left + 1).bit_length() - 1
+		row = self.table[level]
+		u, v = row[left], row[right - (1 << level) + 1]
+		return u if self.depth[u] <= self.depth[v] else v
+
+	def in_tree(self, pos):
+		""" Returns whether the index can answer queries about a position directly """
+		return self.is_tree and pos[0] * self.dimensions[1] + pos[1] in self.first
+
+	def distance(self, start, end):
+		""" Returns the length of the shortest path from start to end, or None if there isn't one """
+		if not (self.in_tree(start) and self.in_tree(end)):
+			return path_cache.distance(self.grid, start, end, self.key)
+		height = self.dimensions[1]
+		a, b = start[0] * height + start[1], end[0] * height + end[1]
+		return self.depth[a] + self.depth[b] - 2 * self.depth[self.lowest_common_ancestor(a, b)]
+
+	def nearest(self, start, targets):
+		""" Returns (target, first_step, distance) for the closest of the target positions in a tree maze,
+		or None if there are none besides start. Ties go to the smallest (x, y), like the search in nearest """
+		height = self.dimensions[1]
+		depth, first, table, parent = self.depth, self.first, self.table, self.parent
+		a = start[0] * height + start[1]
+		left = first[a]
+		best = None
+		for pos in targets:
+			b = pos[0] * height + pos[1]
+			if b == a:
+				continue
+			# The lowest common ancestor, inlined since this runs for every item on every step
+			lo, hi = (left, first[b]) if left < first[b] else (first[b], left)
+			level = (hi - lo + 1).bit_length() - 1
+			u, v = table[level][lo], table[level][hi - (1 << level) + 1]
+			ancestor = u if depth[u] <= depth[v] else v
+			candidate = (depth[a] + depth[b] - 2 * depth[ancestor], b, ancestor)
+			if best is None or candidate < best:
+				best = candidate
+		if best is None:
+			return None
+		distance, b, ancestor = best
+		# The first step goes up to start's parent, unless the target lies below start
+		if ancestor != a:
+			step = parent[a]
+		else:
+			step = b
+			while depth[step] > depth[a] + 1:
+				step = parent[step]
+		return divmod(b, height), divmod(step, height), distance
+
+	def path(self, start, end):
+		""" Returns the (path, total_length) of the shortest path from start to end, or None if there isn't one """
+		if not (self.in_tree(start) and self.in_tree(end)):
+			return path_cache.path(self.grid, start, end, self.key)
+		height = self.dimensions[1]
+		a, b = start[0] * height + start[1], end[0] * height + end[1]
+		ancestor = self.lowest_common_ancestor(a, b)
+		up, down = [], []
+		while a != ancestor:
+			up.append(divmod(a, height))
+			a = self.parent[a]
+		while b != ancestor:
+			down.append(divmod(b, height))
+			b = self.parent[b]
+		up.append(divmod(ancestor, height))
+		up.extend(reversed(down))
+		return up, len(up) - 1
@@ -0,0 +1,149 @@
+import os
+import numpy as np
+import pygame
+
+# This file renders ChestsAndKeys grids into RGB arrays without opening a display, for recording rollouts on headless machines
+# Images are (H * sprite_size, W * sprite_size, 3) uint8 arrays with rows going down the grid, like the window ChestsAndKeys.draw opens
+
+RESOURCES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Resources')
+TILE_SPRITES = ['floor.png', 'wall.png', 'chest.png', 'key.png']
+AGENT_SPRITE = 'agent.png'
+NUM_TILES = len(TILE_SPRITES)
+FONT = 'FreeSans.ttf'
+BACKGROUND = (255, 255, 255)
+WALL = 1
+
+# Assets are loaded the first time they're asked for and then kept for the whole process,
+# so environments that are created over and over (every reset creates one) don't touch the disk again
+_sprites = {}
+_fonts = {}
+_atlases = {}
+_display = None
+
+def sprites(sprite_size):
+	""" Returns a dictionary from file name to the pygame surface of every sprite in the resources, scaled to sprite_size """
+	scaled = _sprites.get(sprite_size)
+	if scaled is None:
+		scaled = _sprites[sprite_size] = {name: pygame.transform.scale(pygame.image.load(os.path.join(RESOURCES, name)), \
+												(sprite_size, sprite_size)) for name in TILE_SPRITES + [AGENT_SPRITE]}
+	return scaled
+
+def font(size):
+	""" Returns the pygame font of the given size, initializing pygame's font module the first time """
+	loaded = _fonts.get(size)
+	if loaded is None:
+		pygame.font.init()
+		loaded = _fonts[size] = pygame.font.Font(os.path.join(RESOURCES, FONT), size)
+	return loaded
+
+def display(dimensions, caption):
+	""" Returns the display surface, opening the window the first time and only resizing it when asked for other dimensions """
+	global _display
+	if _display is None or _display.get_size() != tuple(dimensions):
+		_display = pygame.display.set_mode(dimensions)
+	pygame.display.set_caption(caption)
+	return _display
+
+def is_current(surface):
+	""" Returns whether a surface returned by display is still the open window.
+	It isn't once any environment closed the display, or asked for other dimensions """
+	return surface is not None and surface is _display and pygame.display.get_surface() is _display
+
+def close_display():
+	""" Quits pygame and forgets the window and the fonts, which don't outlive it. The sprites are kept """
+	global _display
+	pygame.quit()
+	_display = None
+	_fonts.clear()
+
+def load_sprite(name, sprite_size):
+	""" Returns (rgb, alpha) arrays of a sprite of shape (sprite_size, sprite_size, 3) and (sprite_size, sprite_size, 1), indexed [x, y] """
+	surface = sprites(sprite_size)[name]
+	rgb = pygame.surfarray.array3d(surface).astype(np.float32)
+	if surface.get_flags() & pygame.SRCALPHA:
+		alpha = pygame.surfarray.array_alpha(surface).astype(np.float32)[:, :, None] / 255
+	else:
+		alpha = np.ones((sprite_size, sprite_size, 1), dtype=np.float32)
+	return rgb, alpha
+
+def sprite_atlas(sprite_size):
+	""" Returns the (2 * NUM_TILES, sprite_size, sprite_size, 3) uint8 atlas of every cell a grid can show, indexed [cell, y, x].
+	Cell t is tile t on the white background, and cell NUM_TILES + t is the agent standing on tile t.
+	Atlases are built once per sprite size """
+	atlas = _atlases.get(sprite_size)
+	if atlas is None:
+		background = np.array(BACKGROUND, dtype=np.float32)
+		agent, agent_alpha = load_sprite(AGENT_SPRITE, sprite_size)
+		cells = []
+		for name in TILE_SPRITES:
+			rgb, alpha = load_sprite(name, sprite_size)
+			cells.append(rgb * alpha + background * (1 - alpha))
+		cells += [agent * agent_alpha + cell * (1 - agent_alpha) for cell in cells]
+		atlas = np.rint(np.stack(cells)).astype(np.uint8).transpose(0, 2, 1, 3)
+		atlas.flags.writeable = False
+		_atlases[sprite_size] = atlas
+	return atlas
+
+def cell_codes(tiles, agent_positions):
+	""" Returns the atlas cell of every tile of a (B, W, H) batch of grids with one agent each """
+	codes = np.array(tiles, dtype=np.intp)
+	positions = np.asarray(agent_positions)
+	codes[np.arange(len(codes)), positions[:, 0], positions[:, 1]] += NUM_TILES
+	return codes
+
+def render_cells(codes, sprite_size = 16, out = None):
+	""" Renders a (B, W, H) batch of atlas cell grids into a (B, H * s, W * s, 3) uint8 array, written into out if it is given.
+	Every image is gathered from the sprite atlas in one indexing operation """
+	atlas = sprite_atlas(sprite_size)
+	codes = np.asarray(codes)
+	batch, width, height = codes.shape
+	# Gather (B, H, W, s, s, 3) cells indexed [b, y, x, row, column], then lay them out as (B, H, s, W, s, 3) images
+	images = atlas[codes.transpose(0, 2, 1)].transpose(0, 1, 3, 2, 4, 5)
+	if out is None:
+		out = np.empty((batch, height * sprite_size, width * sprite_size, 3), dtype=np.uint8)
+	out.reshape(batch, height, sprite_size, width, sprite_size, 3)[:] = images
+	return out
+
+def render_batch(tiles, agent_positions, sprite_size = 16, out = None):
+	""" Renders a (B, W, H) batch of grids with agents at the (B, 2) positions into a (B, H * s, W * s, 3) uint8 array,
+	written into out if it is given """
+	return render_cells(cell_codes(tiles, agent_positions), sprite_size, out)
+
+def render(tiles, agent_pos, sprite_size = 16):
+	""" Renders one grid with the agent at agent_pos into a new (H * s, W * s, 3) uint8 array """
+	return render_batch([np.asarray(tiles)], [agent_pos], sprite_size)[0]
+
+class Renderer:
+	"""
+	Renders the frames of one environment into the same RGB array, redrawing only the cells that changed since the last frame.
+	The walls and floor of a maze are rendered once and kept as a static layer, so a new frame in the same maze
+	starts from a copy of that layer only when a wall changed, which is what a new episode looks like.
+	"""
+	def __init__(self, sprite_size = 16):
+		self.sprite_size = sprite_size
+		self.atlas = sprite_atlas(sprite_size)
+		self.frame = None
+		self.codes = None
+		self.static_key = None
+		self.static_layer = None
+
+	def render(self, tiles, agent_pos):
+		""" Renders a grid with the agent at agent_pos and returns the frame.
+		The frame is reused for the next call, so copy it to keep it """
+		codes = cell_codes([tiles], [agent_pos])[0]
+		walls = (codes == WALL) | (codes == NUM_TILES + WALL)
+		key = (walls.shape, walls.tobytes())
+		if key != self.static_key:
+			# Only walls and floor go into the static layer, since items come and go within a maze
+			self.static_key = key
+			self.codes = np.where(walls, WALL, 0)
+			self.static_layer = render_cells([self.codes], self.sprite_size)[0]
+			self.frame = self.static_layer.copy()
+		changed = np.nonzero(codes != self.codes)
+		if len(changed[0]) > 0:
+			width, height = codes.shape
+			# A (H, W, s, s, 3) view of the frame, indexed [y, x, row, column]
+			cells = self.frame.reshape(height, self.sprite_size, width, self.sprite_size, 3).swapaxes(1, 2)
+			cells[changed[1], changed[0]] = self.atlas[codes[changed]]
+			self.codes = codes
+		return self.frame
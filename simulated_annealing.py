@@ -1,52 +1,195 @@
 from __future__ import print_function
 import math
 import random
+import time
+import numpy as np
 import common
+import dynamic_programming
 import greedy
+import multistart
 import opt2
-from simanneal import Annealer
 
-class ShortestPathAnnealer(Annealer):
+# Temperatures are in units of the instance's mean distance, so one schedule fits every instance of a size
+TMAX = 2.0
+TMIN = 0.002
+MIN_STEPS = 2000
+STEPS_PER_NODE = 400
+# Instances up to this many nodes are solved exactly, which is faster than the heuristics below it
+EXACT_MAX_NODES = 14
+# Larger instances start annealing from the best of this many 2-opt runs
+RESTARTS = 11
 
-    def __init__(self, state, distance_matrix, v):
-        self.distance_matrix = distance_matrix
+class Schedule:
+    """An exponential cooling schedule from tmax down to tmin over a number of steps,
+    stored as the inverse temperature of every step"""
+
+    def __init__(self, tmax, tmin, steps):
+        self.tmax = tmax
+        self.tmin = tmin
+        self.steps = steps
+        self.betas = (1.0 / np.geomspace(tmax, tmin, steps)).tolist()
+
+_schedules = {}
+
+def schedule_for(size):
+    """Returns the schedule for routes over size nodes, built the first time it's needed"""
+    schedule = _schedules.get(size)
+    if schedule is None:
+        schedule = _schedules[size] = Schedule(TMAX, TMIN, max(MIN_STEPS, STEPS_PER_NODE * size))
+    return schedule
+
+class AnnealStats:
+    """Counters for how the annealer is doing. Call reset() before a run and read them afterwards"""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """Zeroes the counters"""
+        self.runs = 0
+        self.moves = 0
+        self.accepted = 0
+        self.seconds = 0.0
+        self.best_trace = []
+
+    def accept_rate(self):
+        """Returns the fraction of proposed moves that were accepted"""
+        return self.accepted / self.moves if self.moves > 0 else 0.0
+
+    def moves_per_second(self):
+        """Returns how many moves were proposed per second of annealing"""
+        return self.moves / self.seconds if self.seconds > 0 else 0.0
+
+stats = AnnealStats()
+
+class ShortestPathAnnealer:
+    """Anneals a route that has to visit a key before every chest it opens.
+    The state is every node, and the route is its first 2 * len(v) entries, the rest being spare chests.
+    Moves swap two entries or reverse a slice of the state in place, and only the edges and balances
+    they touch are looked at, so a move costs O(1) for a swap and O(segment) for a reversal.
+    Rejected moves are undone by applying them again"""
+
+    def __init__(self, state, distance_matrix, v, schedule=None):
+        self.state = list(state)
+        self.matrix = distance_matrix.tolist() if isinstance(distance_matrix, np.ndarray) else distance_matrix
         self.v = v
-        super(ShortestPathAnnealer, self).__init__(state)
-
-    def move(self):
-        candidate = self.state[:]
-        movement = random.choice(['swap', 'rev'])
-        if movement == 'swap':
-            a = random.randint(0, len(self.state) - 1)
-            b = random.randint(0, len(self.state) - 1)
-            candidate[a], candidate[b] = self.state[b], self.state[a]
-        else:
-            l = random.randint(2, len(self.state) - 1)
-            i = random.randint(0, len(self.state) - l)
-            candidate[i : (i+l)] = reversed(candidate[i : (i + l)])
-        valid = common.path_valid(candidate[:len(self.v)*2], self.v)
-        if valid:
-            self.state = candidate
-
-        return self.energy()
+        self.length = min(len(v) * 2, len(self.state))
+        self.sign = {node: (1 if node in v else -1) for node in self.state}
+        # balance[j + 1] is the number of keys minus chests in the first j + 1 entries of the route
+        self.balance = [0] * (self.length + 1)
+        self.rebalance(0, self.length - 1)
+        self.schedule = schedule if schedule is not None else schedule_for(len(self.state))
 
     def energy(self):
-        return common.path_distance(self.distance_matrix, self.state[:len(self.v)*2])
-
-def solve_annealer(distance_matrix, v, s):
-    opt2_state, opt2_distance = opt2.solve_2opt(distance_matrix, v, s)
-    for i in range(10):
-        state, distance = opt2.solve_2opt(distance_matrix, v, s)
-        if distance < opt2_distance:
-            opt2_state, opt2_distance = state, distance
+        return common.path_distance(self.matrix, self.state[:self.length])
+
+    def rebalance(self, lo, hi):
+        """Recomputes the balances after entries lo to hi and returns whether they are all non-negative"""
+        balance, sign, state = self.balance, self.sign, self.state
+        valid = True
+        for j in range(lo, hi + 1):
+            balance[j + 1] = balance[j] + sign[state[j]]
+            if balance[j + 1] < 0:
+                valid = False
+        return valid
+
+    def edges(self, starts):
+        """Returns the total length of the route edges starting at the given entries"""
+        matrix, state = self.matrix, self.state
+        return sum(matrix[state[j]][state[j + 1]] for j in starts if 0 <= j < self.length - 1)
+
+    def reverse(self, i, k):
+        """Reverses entries i to k of the state in place"""
+        self.state[i:k + 1] = self.state[k:i - 1 if i > 0 else None:-1]
+
+    def swap(self, a, b):
+        """Swaps entries a and b of the state"""
+        self.state[a], self.state[b] = self.state[b], self.state[a]
+
+    def scale(self):
+        """Returns the mean finite distance between the nodes, which the temperatures are multiplied by"""
+        distances = [self.matrix[a][b] for a in self.state for b in self.state if a != b]
+        distances = [d for d in distances if d < math.inf]
+        return sum(distances) / len(distances) if distances and sum(distances) > 0 else 1.0
+
+    def anneal(self):
+        """Runs the schedule and returns the best (route, length) seen"""
+        started = time.time()
+        state, length = self.state, self.length
+        size = len(state)
+        energy = self.energy()
+        best_energy, best_route = energy, state[:length]
+        best_trace = [(0, energy)]
+        inverse_scale = 1.0 / self.scale()
+        rand, randint, exp = random.random, random.randint, math.exp
+        accepted = 0
+        steps = self.schedule.steps if size > 1 else 0
+        for step, beta in enumerate(self.schedule.betas[:steps]):
+            # Pick a move like the simanneal version did: a swap of any two entries or a reversal of any slice
+            if size < 3 or rand() < 0.5:
+                a, b = randint(0, size - 1), randint(0, size - 1)
+                if a > b:
+                    a, b = b, a
+                if a == b or a >= length:
+                    accepted += 1
+                    continue
+                if b >= length:
+                    starts = (a - 1, a) # A spare chest takes the place of entry a
+                elif b == a + 1:
+                    starts = (a - 1, b) # The edge between the two keeps its length
+                else:
+                    starts = (a - 1, a, b - 1, b)
+                before = self.edges(starts)
+                self.swap(a, b)
+                lo, hi, undo = a, min(b, length - 1), (self.swap, a, b)
+            else:
+                span = randint(2, size - 1)
+                i = randint(0, size - span)
+                k = i + span - 1
+                if i >= length:
+                    accepted += 1
+                    continue
+                # Inside the route only the two end edges change, since the distances are symmetric
+                starts = (i - 1, k) if k < length else range(i - 1, length - 1)
+                before = self.edges(starts)
+                self.reverse(i, k)
+                lo, hi, undo = i, min(k, length - 1), (self.reverse, i, k)
+            delta = self.edges(starts) - before
+            if self.rebalance(lo, hi) and (delta <= 0 or rand() < exp(-delta * inverse_scale * beta)):
+                accepted += 1
+                energy += delta
+                if energy < best_energy - 1e-12:
+                    best_energy, best_route = energy, state[:length]
+                    best_trace.append((step + 1, energy))
+            else:
+                undo[0](undo[1], undo[2])
+                self.rebalance(lo, hi)
+        stats.runs += 1
+        stats.moves += steps
+        stats.accepted += accepted
+        stats.seconds += time.time() - started
+        stats.best_trace = best_trace
+        # The running energy has picked up rounding from the deltas, so the best route is measured again
+        return best_route, common.path_distance(self.matrix, best_route)
+
+def anneal_from(state, distance_matrix, v):
+    """Runs one annealing chain from state and returns its best (route, length)"""
+    return ShortestPathAnnealer(state, distance_matrix, v).anneal()
+
+def solve_annealer(distance_matrix, v, s, workers=1, seed=None, chains=1):
+    """Returns a short valid (route, length), exact for small instances.
+    Larger ones get the best of RESTARTS 2-opt runs, which the best of several annealing chains then starts from.
+    With workers other than 1 the runs and chains are spread over a process pool (every core for None),
+    and with a seed the result is the same every time. stats only counts the chains run in this process"""
+    if len(v) + len(s) <= EXACT_MAX_NODES:
+        return dynamic_programming.solve_dp(distance_matrix, v, s)
+    seeds = multistart.task_seeds(RESTARTS + chains, seed, workers)
+    restarts = multistart.run(opt2.solve_2opt, [(distance_matrix, v, s)] * RESTARTS, seeds[:RESTARTS], workers)
+    opt2_state, opt2_distance = multistart.best(restarts)
     init_state = opt2_state + list(s - set(opt2_state))
 
-    annealer = ShortestPathAnnealer(init_state, distance_matrix, v)
-    schedule = annealer.auto(minutes=0.001)
-    # print(schedule)
-    annealer.set_schedule(schedule)
-    annealer.copy_strategy = "slice"
-    state, e = annealer.anneal()
+    annealed = multistart.run(anneal_from, [(init_state, distance_matrix, v)] * chains, seeds[RESTARTS:], workers)
+    state, e = multistart.best(annealed)
 
     if opt2_distance < e:
         state, e = opt2_state, opt2_distance